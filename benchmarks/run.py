@@ -0,0 +1,393 @@
+"""
+Benchmarks of django_rollback hot paths on a synthetic django project.
+
+Project with N apps (M migrations every one), git repository with T tagged commits and K saved states is generated
+in temporary directory, then every operation is executed R times and JSON report with timings is written.
+Reports of different versions can be compared by --compare argument.
+
+    python benchmarks/run.py --apps 50 --migrations 5 --states 10000 --tags 100 --output report.json
+    python benchmarks/run.py --compare report.json
+
+SQLite database is used by default, throwaway PostgreSQL database can be used by --postgres argument
+(connection options are read from PGHOST, PGPORT, PGUSER, PGPASSWORD environment variables by libpq).
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import secrets
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from functools import partial
+from io import StringIO
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SETTINGS_TEMPLATE = """
+SECRET_KEY = 'benchmark'
+USE_TZ = True
+INSTALLED_APPS = ['django_rollback'] + {apps!r}
+DATABASES = {{'default': {database!r}}}
+DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
+"""
+
+INITIAL_MIGRATION_TEMPLATE = """
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name='Item',
+            fields=[('id', models.AutoField(primary_key=True, serialize=False))],
+        ),
+    ]
+"""
+
+MIGRATION_TEMPLATE = """
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [({app!r}, {previous!r})]
+
+    operations = [
+        migrations.AddField(model_name='item', name={field!r}, field=models.IntegerField(default=0)),
+    ]
+"""
+
+
+def get_migration_name(number):
+    return f'{number:04d}_initial' if number == 1 else f'{number:04d}_field_{number}'
+
+
+def create_project(path, apps_count, migrations_count, postgres=None):
+    apps = [f'app_{index:04d}' for index in range(apps_count)]
+    for app in apps:
+        migrations_dir = os.path.join(path, app, 'migrations')
+        os.makedirs(migrations_dir)
+        open(os.path.join(path, app, '__init__.py'), 'w').close()
+        open(os.path.join(migrations_dir, '__init__.py'), 'w').close()
+
+        for number in range(1, migrations_count + 1):
+            if number == 1:
+                content = INITIAL_MIGRATION_TEMPLATE
+            else:
+                content = MIGRATION_TEMPLATE.format(app=app, previous=get_migration_name(number - 1),
+                                                    field=f'field_{number}')
+            with open(os.path.join(migrations_dir, f'{get_migration_name(number)}.py'), 'w') as fh:
+                fh.write(content)
+
+    if postgres:
+        database = {'ENGINE': 'django.db.backends.postgresql', 'NAME': postgres}
+    else:
+        database = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(path, 'db.sqlite3')}
+
+    with open(os.path.join(path, 'benchmark_settings.py'), 'w') as fh:
+        fh.write(SETTINGS_TEMPLATE.format(apps=apps, database=database))
+
+    return apps
+
+
+def create_repository(path, tags_count):
+    """
+    every tag points to its own commit, HEAD is the last tagged commit
+    :return list of commits from older to newer
+    """
+    import git
+
+    repo = git.Repo.init(path)
+    with repo.config_writer() as config:
+        config.set_value('user', 'name', 'benchmark')
+        config.set_value('user', 'email', 'benchmark@example.com')
+
+    commits = []
+    for index in range(max(tags_count, 2)):
+        commit = repo.index.commit(f'commit {index}')
+        repo.create_tag(f'v{index:04d}', ref=commit)
+        commits.append(commit.hexsha)
+    return commits
+
+
+def measure(func, repeat, teardown=None):
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - started) * 1000)
+        if teardown is not None:
+            teardown()
+
+    return {
+        'repeat': repeat,
+        'min_ms': round(min(durations), 3),
+        'median_ms': round(statistics.median(durations), 3),
+        'max_ms': round(max(durations), 3),
+    }
+
+
+def get_synthetic_states(apps_count):
+    """
+    states of apps_count apps, where every 10th app differs and every 100th app is missing in other state
+    """
+    current = [(index * 2 + 1, f'app_{index:05d}', '0002_second') for index in range(apps_count)]
+    other = [
+        (index * 2, app, '0001_initial' if index % 10 == 0 else name)
+        for index, (_, app, name) in enumerate(current) if index % 100 != 0
+    ]
+    return current, other
+
+
+def execute_sql(connection, sql):
+    with connection.cursor() as cursor:
+        cursor.execute(sql)
+        return cursor.fetchall()
+
+
+def run_benchmarks(options, project_dir):
+    apps = create_project(project_dir, options.apps, options.migrations, options.postgres)
+    commits = create_repository(project_dir, options.tags)
+    previous_commit, current_commit = commits[-2:]
+
+    sys.path.insert(0, project_dir)
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'benchmark_settings'
+    import django
+    django.setup()
+
+    from django.core.management import call_command
+    from django.db import connections, transaction
+    from django.db.migrations.executor import MigrationExecutor
+
+    from django_rollback.api import DEFAULT_LOGGER_NAME, RollbackService
+    from django_rollback.models import AppsState
+    from django_rollback.snapshots import get_state_hash
+    from django_rollback.sql import MIGRATIONS_STATE_SQL, MIGRATIONS_STATE_SQL_POSTGRESQL, MIGRATIONS_STATE_SQL_WINDOW
+
+    # events are formatted as usual, but they are not printed
+    logging.getLogger(DEFAULT_LOGGER_NAME).addHandler(logging.NullHandler())
+
+    service = RollbackService(repo_path=project_dir, provider='git')
+    command_options = {'path': project_dir, 'provider': 'git', 'stdout': StringIO(), 'stderr': StringIO()}
+
+    def migrate_to_previous_state():
+        connection = connections['default']
+        executor = MigrationExecutor(connection)
+        targets = [(app, get_migration_name(options.migrations - 1)) for app in apps]
+        executor.migrate(targets)
+
+    def save_state(commit):
+        return RollbackService(repo_path=project_dir, provider='arg', current_commit=commit).save_state()
+
+    # previous state: the last migration of every app is not applied
+    started = time.perf_counter()
+    call_command('migrate', 'django_rollback', verbosity=0)
+    call_command('migrate', verbosity=0)
+    migrate_to_previous_state()
+
+    # old states are created before the previous one, they use the same snapshot and tagged commits if possible
+    state_data = service.get_current_migrations_state()
+    snapshot = service.get_or_create_snapshot(state_data, get_state_hash(state_data))
+    old_commits = commits[:-2] + [secrets.token_hex(20) for _ in range(max(options.states - len(commits), 0))]
+    AppsState.objects.bulk_create(
+        [AppsState(commit=commit, snapshot=snapshot) for commit in old_commits[:max(options.states - 2, 0)]],
+        batch_size=1000,
+    )
+    save_state(previous_commit)
+    call_command('migrate', verbosity=0)
+    save_state(current_commit)
+    setup_ms = round((time.perf_counter() - started) * 1000, 3)
+
+    middle_commit = old_commits[len(old_commits) // 2] if old_commits else previous_commit
+
+    def restore(fake):
+        call_command('migrate', fake=fake, verbosity=0)
+        save_state(current_commit)
+
+    results = {}
+    results['save_migrations_state'] = measure(
+        lambda: call_command('save_migrations_state', **command_options), options.repeat,
+    )
+    results['save_state_new_commit'] = measure(
+        lambda: save_state(secrets.token_hex(20)), options.repeat,
+        # new state is deleted, so current commit is the latest again
+        teardown=lambda: service.make_the_last_state_for_commit(current_commit),
+    )
+    results['rollback_migrations_list'] = measure(
+        lambda: call_command('rollback_migrations', list=True, **command_options), options.repeat,
+    )
+    results['check_migrations_state'] = measure(lambda: service.check_state(), options.repeat)
+
+    results['get_apps_state_by_commit'] = measure(
+        lambda: service.get_apps_state_by_commit(middle_commit), options.repeat,
+    )
+    results['get_apps_state_by_commit_prefix'] = measure(
+        lambda: service.get_apps_state_by_commit(middle_commit[:8]), options.repeat,
+    )
+    results['get_migrations_data_by_commit'] = measure(
+        lambda: service.get_migrations_data_by_commit(previous_commit), options.repeat,
+    )
+
+    current, other = get_synthetic_states(options.diff_apps)
+    results[f'get_migrations_diff_{options.diff_apps}_apps'] = measure(
+        lambda: service.get_migrations_diff(current, other), options.repeat,
+    )
+
+    results['rollback_migrations_fake'] = measure(
+        lambda: call_command('rollback_migrations', fake=True, **command_options), options.repeat,
+        teardown=lambda: restore(fake=True),
+    )
+    results['rollback_migrations'] = measure(
+        lambda: call_command('rollback_migrations', **command_options), options.repeat,
+        teardown=lambda: restore(fake=False),
+    )
+
+    # state query over large django_migrations table, inserted rows are rolled back
+    with transaction.atomic():
+        rows_per_app = max(options.state_rows // options.diff_apps, 1)
+        with connections['default'].cursor() as cursor:
+            cursor.executemany(
+                'insert into django_migrations (app, name, applied) values (%s, %s, %s)',
+                [(f'bench_{index % options.diff_apps:05d}', f'{index // options.diff_apps:04d}', '2000-01-01')
+                 for index in range(options.diff_apps * rows_per_app)],
+            )
+        rows = options.diff_apps * rows_per_app
+        results[f'migrations_state_sql_{rows}_rows'] = measure(
+            lambda: service.get_current_migrations_state(), options.repeat,
+        )
+
+        # every strategy is measured, so the selected one can be compared with others
+        strategies = {'orm': None, 'aggregate': MIGRATIONS_STATE_SQL}
+        if connections['default'].vendor == 'postgresql':
+            strategies['distinct_on'] = MIGRATIONS_STATE_SQL_POSTGRESQL
+        if connections['default'].vendor != 'sqlite' or sqlite3.sqlite_version_info >= (3, 25):
+            strategies['window'] = MIGRATIONS_STATE_SQL_WINDOW
+
+        for name, sql in strategies.items():
+            results[f'migrations_state_{name}_{rows}_rows'] = measure(
+                partial(execute_sql, connections['default'], sql) if sql else service.get_current_migrations_state_orm,
+                options.repeat,
+            )
+        transaction.set_rollback(True)
+
+    # lookups by commit as table of states grows, latency should not depend on its size
+    snapshot = service.get_last_apps_state().snapshot
+    for size in sorted(options.lookup_sizes):
+        count = AppsState.objects.count()
+        commits = [secrets.token_hex(20) for _ in range(max(size - count, 0))]
+        AppsState.objects.bulk_create([AppsState(commit=commit, snapshot=snapshot) for commit in commits],
+                                      batch_size=1000)
+        size = max(size, count)
+        commit = commits[len(commits) // 2] if commits else middle_commit
+
+        results[f'get_apps_state_by_commit_{size}_states'] = measure(
+            lambda: service.get_apps_state_by_commit(commit), options.repeat,
+        )
+        results[f'get_apps_state_by_commit_prefix_{size}_states'] = measure(
+            lambda: service.get_apps_state_by_commit(commit[:8]), options.repeat,
+        )
+        results[f'get_previous_commit_{size}_states'] = measure(
+            lambda: service.get_previous_commit(), options.repeat,
+        )
+
+    return setup_ms, results
+
+
+def get_package_revision():
+    try:
+        import git
+        return git.Repo(ROOT_DIR).head.commit.hexsha
+    except Exception:
+        return None
+
+
+def compare_reports(report, baseline):
+    format_string = '{:<40}  {:>12}  {:>12}  {:>8}'
+    print(format_string.format('BENCHMARK', 'BASELINE MS', 'MEDIAN MS', 'RATIO'))
+    for name, result in report['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            print(format_string.format(name, '-', f'{result["median_ms"]:.1f}', '-'))
+            continue
+        ratio = result['median_ms'] / base['median_ms'] if base['median_ms'] else float('inf')
+        print(format_string.format(name, f'{base["median_ms"]:.1f}', f'{result["median_ms"]:.1f}', f'{ratio:.2f}'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks of django_rollback on a synthetic django project.')
+    parser.add_argument('--apps', type=int, default=50, help='Count of apps in project (N).')
+    parser.add_argument('--migrations', type=int, default=5, help='Count of migrations of every app (M).')
+    parser.add_argument('--states', type=int, default=10000, help='Count of saved states (K).')
+    parser.add_argument('--tags', type=int, default=100, help='Count of tagged commits in git repository (T).')
+    parser.add_argument('--diff-apps', type=int, default=5000, help='Count of apps in states compared by diff.')
+    parser.add_argument('--state-rows', type=int, default=100000,
+                        help='Count of django_migrations rows for migrations state query.')
+    parser.add_argument('--lookup-sizes', type=lambda value: [int(size) for size in value.split(',')],
+                        default=[1000, 10000, 100000],
+                        help='Comma separated counts of states to measure lookups by commit as table grows.')
+    parser.add_argument('--repeat', type=int, default=5, help='Count of runs of every benchmark.')
+    parser.add_argument('--postgres', type=str, metavar='NAME',
+                        help='Name of throwaway PostgreSQL database, it should be empty and it is not cleaned up.')
+    parser.add_argument('--output', type=str, help='Path of JSON report, it is printed to stdout by default.')
+    parser.add_argument('--compare', type=str, metavar='BASELINE', help='Path of JSON report to compare with.')
+    parser.add_argument('--keep', action='store_true', help='Keep generated project directory.')
+    options = parser.parse_args()
+
+    if options.migrations < 2:
+        parser.error('--migrations should be at least 2 to have a state to rollback to.')
+
+    sys.path.insert(0, ROOT_DIR)
+    project_dir = tempfile.mkdtemp(prefix='django_rollback_benchmark_')
+    try:
+        setup_ms, results = run_benchmarks(options, project_dir)
+    finally:
+        if options.keep:
+            print(f'Project directory: {project_dir}', file=sys.stderr)
+        else:
+            shutil.rmtree(project_dir, ignore_errors=True)
+
+    import django
+    from django.db import connections
+
+    report = {
+        'revision': get_package_revision(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'vendor': connections['default'].vendor,
+        'params': {
+            'apps': options.apps,
+            'migrations': options.migrations,
+            'states': options.states,
+            'tags': options.tags,
+            'diff_apps': options.diff_apps,
+            'state_rows': options.state_rows,
+            'lookup_sizes': options.lookup_sizes,
+            'repeat': options.repeat,
+        },
+        'setup_ms': setup_ms,
+        'results': results,
+    }
+
+    content = json.dumps(report, indent=2)
+    if options.output:
+        with open(options.output, 'w') as fh:
+            fh.write(content + '\n')
+    elif not options.compare:
+        print(content)
+
+    if options.compare:
+        with open(options.compare) as fh:
+            compare_reports(report, json.load(fh))
+
+
+if __name__ == '__main__':
+    main()
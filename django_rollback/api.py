@@ -0,0 +1,1063 @@
+"""
+In-process API of django_rollback: save, list and compare states, plan and run rollback
+without management commands (and without Django startup for every call).
+Management commands are thin wrappers around RollbackService.
+
+Every operation returns typed results (namedtuples) and raises RollbackError on failure,
+progress events are sent to logger (`django_rollback` by default) with the same fields as in commands.
+Async wrappers (asave_state, alist_states, adiff, aplan_rollback, arollback, etc.) run operations in threads
+by asgiref `sync_to_async`, so one long-lived process can drive many services concurrently.
+"""
+import json
+import logging
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import timedelta
+from functools import partial, wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, router
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from django_rollback.consts import (
+    DEFAULT_REPO_PATH, COMMIT_MAX_LENGTH, DEFAULT_COMMIT_PROVIDER, DEFAULT_BUILD_INFO_PATH, SAVE_STATE_ATTEMPTS,
+    PRUNE_BATCH_SIZE, NAMESPACE_SETTING, DEFAULT_NAMESPACE,
+)
+from django_rollback.diff import MigrationRecord, diff_states
+from django_rollback.exceptions import RollbackError
+from django_rollback.executor import RollbackExecutor, migration_key
+from django_rollback.log import LogSink
+from django_rollback.models import AppsState, MigrationsSnapshot, RollbackRun, RollbackStep
+from django_rollback.profiling import Profiler
+from django_rollback.providers import ProviderError, get_commit_provider
+from django_rollback.snapshots import get_state_hash, serialize_state
+from django_rollback.sql import SAVE_STATE_SQL_POSTGRESQL, get_migrations_state_sql
+
+DEFAULT_LOGGER_NAME = 'django_rollback'
+
+CHECK_OK = 'ok'
+CHECK_DRIFT = 'drift'
+CHECK_MISSING = 'missing'
+
+# current commit does not change while process is running (for example, in readiness probe endpoint),
+# so it is cached by provider options for check_state()
+_current_commits = {}
+
+SaveStateResult = namedtuple('SaveStateResult', [
+    'database', 'commit', 'created', 'timestamp', 'latest_commit', 'latest_timestamp', 'is_same_snapshot',
+    'previous_commit', 'migrations',
+])
+StateInfo = namedtuple('StateInfo', ['database', 'commit', 'timestamp', 'tags', 'is_current'])
+StatesDiff = namedtuple('StatesDiff', ['database', 'commit_a', 'commit_b', 'diff'])
+RollbackPlan = namedtuple('RollbackPlan', ['database', 'current_commit', 'other_commit', 'records', 'run'])
+RollbackResult = namedtuple('RollbackResult', [
+    'database', 'current_commit', 'other_commit', 'records', 'error', 'duration_ms',
+])
+PruneResult = namedtuple('PruneResult', ['database', 'deleted', 'kept', 'snapshots_deleted'])
+CheckResult = namedtuple('CheckResult', [
+    'database', 'commit', 'status', 'current_hash', 'stored_hash', 'migrations',
+])
+RollbackRunInfo = namedtuple('RollbackRunInfo', [
+    'id', 'database', 'status', 'started', 'current_commit', 'other_commit', 'unapplied', 'planned', 'error',
+])
+
+
+class RollbackService:
+
+    def __init__(self, repo_path=DEFAULT_REPO_PATH, provider=DEFAULT_COMMIT_PROVIDER,
+                 build_info_path=DEFAULT_BUILD_INFO_PATH, current_commit=None, databases=None, namespace=None,
+                 logger=None, log_sink=None, profiler=None):
+        """
+        databases: list of aliases to process, ['default'] by default
+        namespace: name of service that separates its states from states of other services in shared table,
+        DJANGO_ROLLBACK_NAMESPACE setting by default
+        logger: logger for events if log_sink is not passed, `django_rollback` logger by default
+        """
+        self._repo_path = repo_path
+        self._provider_options = {
+            'name': provider or DEFAULT_COMMIT_PROVIDER,
+            'build_info_path': build_info_path,
+            'current_commit': current_commit,
+        }
+        if namespace is None:
+            namespace = getattr(settings, NAMESPACE_SETTING, DEFAULT_NAMESPACE)
+        self.namespace = namespace
+        self._provider = None
+        self._repo_tags = None
+        self._commits_info = {}
+        self._database = threading.local()
+        self._step = threading.local()
+        self._is_parallel = False
+        self.log_sink = log_sink or LogSink(logger=logger or logging.getLogger(DEFAULT_LOGGER_NAME))
+        self.profiler = profiler or Profiler(sender=self.__class__)
+
+        self._databases = list(databases or [DEFAULT_DB_ALIAS])
+        for database in self._databases:
+            if database not in connections:
+                self.log(f'Unknown database alias `{database}`.', log_level=logging.ERROR)
+                raise RollbackError(f'Unknown database alias `{database}`.')
+
+    @property
+    def databases(self):
+        return self._databases
+
+    def get_states(self, database=None):
+        """
+        states of namespace of service for database (or all processed databases)
+        """
+        queryset = AppsState.objects.filter(namespace=self.namespace)
+        if database is None:
+            return queryset.filter(database__in=self.databases)
+        return queryset.filter(database=database)
+
+    def get_rollback_runs(self, database):
+        return RollbackRun.objects.filter(namespace=self.namespace, database=database)
+
+    @property
+    def is_multi_database(self):
+        return len(self._databases) > 1
+
+    @contextmanager
+    def use_database(self, database):
+        """
+        messages logged inside the block (in the current thread) are marked by database alias
+        """
+        self._database.alias = database
+        try:
+            yield
+        finally:
+            self._database.alias = None
+
+    def get_log_prefix(self, database):
+        return f'[{database}] ' if database and self.is_multi_database else ''
+
+    def log(self, message, style=None, ending='\n', log_level=logging.INFO, exc_info=False, **fields):
+        """
+        style is a name of output style for commands (SUCCESS, WARNING, ERROR)
+        """
+        fields.setdefault('database', getattr(self._database, 'alias', None))
+        self.log_sink.event(message, style=style, ending=ending, log_level=log_level, exc_info=exc_info,
+                            prefix=self.get_log_prefix(fields['database']), **fields)
+
+    def fail(self, message, log_level=logging.ERROR, **fields):
+        """
+        log message and return RollbackError to raise
+        """
+        self.log(message, style='ERROR', log_level=log_level, **fields)
+        return RollbackError(message)
+
+    # public API
+
+    def save_state(self):
+        """
+        save migrations state of every database for current commit
+        :return list of SaveStateResult
+        """
+        commit = self.get_current_commit()
+        results = []
+        for database in self.databases:
+            with self.use_database(database):
+                state_data = self.get_current_migrations_state(database)
+                results.append(self.save_apps_state(commit, state_data, database))
+        return results
+
+    def list_states(self, limit=None, offset=0, since=None):
+        """
+        states of all databases sorted from newer to older, they are streamed from DB without loading all rows
+        to memory, only commit and timestamp columns are fetched
+        :return iterator of StateInfo
+        """
+        current_commit = self.get_current_commit()
+        repo_tags = self.repo_tags  # tags map is computed once for all rows
+
+        queryset = self.get_states().order_by('-timestamp', '-id')
+        if since is not None:
+            queryset = queryset.filter(timestamp__gte=since)
+        if limit is not None:
+            queryset = queryset[offset:offset + limit]
+        elif offset:
+            queryset = queryset[offset:]
+
+        return (
+            StateInfo(database, commit, timestamp, sorted(repo_tags.get(commit, []), reverse=True),
+                      commit == current_commit)
+            for commit, timestamp, database in queryset.values_list('commit', 'timestamp', 'database').iterator()
+        )
+
+    def diff(self, commit_a, commit_b, database=DEFAULT_DB_ALIAS):
+        """
+        compare two stored states of database (what changed in A relative to B)
+        :return StatesDiff
+        """
+        commit_a = self.search_commit(commit_a, database)
+        commit_b = self.search_commit(commit_b, database)
+
+        diff = diff_states(self.get_migrations_data_by_commit(commit_a, database),
+                           self.get_migrations_data_by_commit(commit_b, database))
+        return StatesDiff(database, commit_a, commit_b, diff)
+
+    def plan_rollback(self, commit=None, tag=None, resume=False):
+        """
+        validate and plan rollback of every database to commit, tag or previous state,
+        or plan resume of the last unfinished rollback run of every database.
+        All databases are validated before any of them is changed.
+        :return list of RollbackPlan
+        """
+        if resume:
+            return self.get_resumed_rollback_plans()
+
+        current_commit = self.get_current_commit()
+        other_commit = self.get_tag_commit(tag) if tag else commit
+
+        plans = []
+        for database in self.databases:
+            with self.use_database(database):
+                plans.append(self.get_rollback_plan(current_commit, other_commit, database))
+        return plans
+
+    def rollback(self, plans=None, commit=None, tag=None, fake=False, jobs=1, resume=False):
+        """
+        run rollback by plans (or plan it by commit, tag or resume args).
+        Every database is rolled back in its own thread, so total time is about the time of the slowest database.
+        Errors do not stop other databases, RollbackError with results of all databases is raised if any failed.
+        :return list of RollbackResult
+        """
+        if plans is None:
+            plans = self.plan_rollback(commit=commit, tag=tag, resume=resume)
+
+        if len(plans) == 1:
+            results = [self.run_rollback_plan(plans[0], fake=fake, jobs=jobs)]
+        else:
+            self.repo_tags  # tags map is loaded once before threads are started
+            results = [None] * len(plans)
+
+            def worker(index):
+                try:
+                    results[index] = self.run_rollback_plan(plans[index], fake=fake, jobs=jobs)
+                finally:
+                    connections.close_all()
+
+            threads = [threading.Thread(target=worker, args=(index,)) for index in range(len(plans))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            self.log_rollback_summary(results)
+
+        failed = [result.database for result in results if result.error is not None]
+        if failed:
+            raise RollbackError(f'Rollback failed for databases: {", ".join(failed)}.', results=results)
+
+        return results
+
+    def check_state(self):
+        """
+        read-only check that current migrations of every database match the state saved for current commit:
+        one aggregate query of django_migrations is hashed and compared with hash of stored snapshot,
+        current commit is cached in the process
+        :return list of CheckResult, status is CHECK_OK, CHECK_DRIFT or CHECK_MISSING (state is not saved)
+        """
+        commit = self.get_cached_current_commit()
+        results = []
+        for database in self.databases:
+            state_data = self.get_current_migrations_state(database)
+            current_hash = get_state_hash(state_data)
+
+            with self.profiler.span('state_lookup'):
+                stored_hash = self.get_states(database).filter(commit=commit) \
+                    .values_list('snapshot__hash', flat=True).first()
+
+            if stored_hash is None:
+                status = CHECK_MISSING
+            else:
+                status = CHECK_OK if stored_hash == current_hash else CHECK_DRIFT
+            results.append(CheckResult(database, commit, status, current_hash, stored_hash, state_data))
+
+        return results
+
+    def prune_states(self, keep_last=None, keep_days=None, batch_size=PRUNE_BATCH_SIZE, dry_run=False,
+                     allow_partial_tags=False):
+        """
+        delete old states of every database by retention policies: the last `keep_last` states,
+        states younger than `keep_days` and states of tagged commits are kept, the latest state is always kept.
+        Rows are deleted in batches by raw DELETE, snapshots without states are deleted after states.
+        Provider should know tags of all commits (git repository or build info file with tags map),
+        otherwise states of tagged commits would be deleted, it is allowed only by `allow_partial_tags`.
+        :return list of PruneResult
+        """
+        if keep_last is None and keep_days is None:
+            raise self.fail('At least one retention policy (keep last states or keep days) should be set.')
+        if keep_last is not None and keep_last < 1:
+            raise self.fail('At least one last state should be kept.')
+
+        keep_last = keep_last or 1
+        since = timezone.now() - timedelta(days=keep_days) if keep_days is not None else None
+        tagged_commits = set(self.get_repository_tags(allow_partial_tags))
+        # snapshots of current migrations may be reused by save_state running at the same time, so they are kept
+        current_hashes = set() if dry_run else {
+            get_state_hash(self.get_current_migrations_state(database)) for database in self.databases
+        }
+
+        results = []
+        for database in self.databases:
+            with self.use_database(database):
+                ids, kept = self.get_states_to_prune(keep_last, since, tagged_commits, database)
+                if dry_run:
+                    results.append(PruneResult(database, len(ids), kept, 0))
+                    continue
+
+                deleted = self.delete_in_batches(AppsState.objects.all(), ids, batch_size)
+                snapshots_deleted = self.delete_orphan_snapshots(batch_size, exclude_hashes=current_hashes)
+                results.append(PruneResult(database, deleted, kept, snapshots_deleted))
+
+        return results
+
+    def get_unfinished_runs(self):
+        """
+        failed or interrupted rollback runs of all databases sorted from newer to older
+        :return list of RollbackRunInfo
+        """
+        runs = RollbackRun.objects.filter(namespace=self.namespace, database__in=self.databases,
+                                          status__in=RollbackRun.UNFINISHED_STATUSES) \
+            .annotate(steps_count=Count('steps')).order_by('-id')
+        return [
+            RollbackRunInfo(run.id, run.database, run.status, run.started, run.current_commit, run.other_commit,
+                            run.steps_count, len(json.loads(run.plan)) if run.plan is not None else None, run.error)
+            for run in runs
+        ]
+
+    # commit and tags
+
+    @property
+    def provider(self):
+        if self._provider is None:
+            try:
+                self._provider = get_commit_provider(repo_path=self._repo_path, **self._provider_options)
+            except ProviderError as err:
+                raise self.fail(str(err))
+        return self._provider
+
+    def get_current_commit(self):
+        try:
+            with self.profiler.span('commit'):
+                return self.provider.get_current_commit()
+        except RollbackError as err:
+            raise err
+        except ProviderError as err:
+            raise self.fail(str(err))
+        except Exception as err:
+            self.log(f'An error occurred while getting current commit from `{self.provider.name}` provider!',
+                     style='ERROR', log_level=logging.ERROR, exc_info=True)
+            raise RollbackError(str(err))
+
+    def get_cached_current_commit(self):
+        key = (self._repo_path,) + tuple(sorted(self._provider_options.items()))
+        if key not in _current_commits:
+            _current_commits[key] = self.get_current_commit()
+        return _current_commits[key]
+
+    def get_tag_commit(self, tag):
+        try:
+            commit = self.provider.get_tag_commit(tag)
+        except RollbackError as err:
+            raise err
+        except Exception as err:
+            self.log(f'An error occurred while getting tags from `{self.provider.name}` provider!',
+                     style='ERROR', log_level=logging.ERROR, exc_info=True)
+            raise RollbackError(str(err))
+
+        if commit is None:
+            raise self.fail(f'Can not find tag `{tag}` in `{self.provider.name}` provider.')
+        return commit
+
+    @property
+    def repo_tags(self):
+        if self._repo_tags is None:
+            try:
+                with self.profiler.span('tags'):
+                    self._repo_tags = self.provider.commits_tags
+
+            except Exception:
+                message = (f'An error occurred while working with `{self.provider.name}` provider '
+                           f'during getting Tags map.')
+                self.log(message, style='WARNING')
+                self._repo_tags = {}
+
+        return self._repo_tags
+
+    def get_repository_tags(self, allow_partial=False):
+        """
+        unlike repo_tags, errors are not ignored, because missing tags map would lead to loss of tagged states
+        :return map {<commit hexsha> : [<tag name>, ...]}
+        """
+        if not self.provider.has_repository_tags and not allow_partial:
+            raise self.fail(f'`{self.provider.name}` provider does not know tags of all commits of repository, '
+                            f'so states of tagged commits can not be kept.')
+
+        try:
+            with self.profiler.span('tags'):
+                return self.provider.commits_tags
+        except RollbackError as err:
+            raise err
+        except Exception as err:
+            raise self.fail(f'Can not get tags map from `{self.provider.name}` provider: {err!r}')
+
+    def get_commit_info(self, commit):
+        if commit not in self._commits_info:
+            self._commits_info[commit] = f'"{commit}" {self.repo_tags.get(commit, [])}'
+        return self._commits_info[commit]
+
+    # states
+
+    def get_previous_commit(self, raise_exception=True, database=DEFAULT_DB_ALIAS):
+        """
+        current commit should be already validated
+        so we are sure that the last state linked to current commit
+        need to select previous commit
+        """
+
+        with self.profiler.span('state_lookup'):
+            commits = list(self.get_states(database).order_by('-timestamp', '-id')
+                           .values_list('commit', flat=True)[:2])
+
+        if len(commits) < 2:
+            message = f'There is only one state in DB. Can`t identify previous state. Rollback procedure impossible.'
+            error = self.fail(message, log_level=logging.WARNING, step='state')
+            if raise_exception:
+                raise error
+
+            return None
+
+        return commits[1]
+
+    def get_last_apps_state(self, database=DEFAULT_DB_ALIAS):
+        with self.profiler.span('state_lookup'):
+            return self.get_states(database).select_related('snapshot') \
+                .defer('snapshot__migrations').order_by('-timestamp', '-id').first()
+
+    def get_current_migrations_state(self, database=DEFAULT_DB_ALIAS):
+        """
+        return a data in format:
+        [(<id> : int, <app> : str, <name> : str), ...]
+        """
+        connection = connections[database]
+        sql = get_migrations_state_sql(connection)
+
+        with self.profiler.span('migrations_state_sql'):
+            if sql is None:
+                return self.get_current_migrations_state_orm(database)
+
+            with connection.cursor() as cursor:
+                cursor.execute(sql)
+                return cursor.fetchall()
+
+    @staticmethod
+    def get_current_migrations_state_orm(database=DEFAULT_DB_ALIAS):
+        """
+        fallback for databases without specific raw sql
+        """
+        migrations = MigrationRecorder.Migration.objects.using(database)
+        max_ids = migrations.values('app').annotate(max_id=Max('id')).values('max_id')
+        return list(migrations.filter(id__in=max_ids).order_by('app').values_list('id', 'app', 'name'))
+
+    def get_apps_state_by_commit(self, commit, with_snapshot=False, database=DEFAULT_DB_ALIAS):
+        """
+        commits are stored as lowercase hex, so all commits with prefix are in range [prefix, prefix + 'g').
+        Range lookup uses the index on commit column on every database (unlike LIKE on SQLite or PostgreSQL
+        without pattern index), and only two rows are fetched to detect ambiguity of short commit hash
+        """
+        commit = commit.lower()
+        queryset = self.get_states(database)
+        if with_snapshot:
+            queryset = queryset.select_related('snapshot')
+        if len(commit) == COMMIT_MAX_LENGTH:
+            queryset = queryset.filter(commit=commit)
+        else:
+            queryset = queryset.filter(commit__gte=commit, commit__lt=f'{commit}g')
+
+        with self.profiler.span('state_lookup'):
+            states = list(queryset[:2])
+
+        if not states:
+            raise self.fail(f'Cant find stored data of migrations state for commit {self.get_commit_info(commit)}.',
+                            log_level=logging.WARNING, step='state')
+
+        if len(states) > 1:
+            raise self.fail(f'Found more than 1 records for selected commit {self.get_commit_info(commit)}. '
+                            f'Please clarify commit hash for more identity.', log_level=logging.WARNING, step='state')
+
+        return states[0]
+
+    def save_apps_state(self, commit, state_data, database=DEFAULT_DB_ALIAS):
+        """
+        create state of database for commit if it does not exist (it is safe for parallel calls),
+        states of all databases are stored in the database selected by router for AppsState model
+        :return SaveStateResult
+        """
+        state_hash = get_state_hash(state_data)
+        with self.profiler.span('save_state'):
+            if connections[router.db_for_write(AppsState)].vendor == 'postgresql':
+                result = self._save_apps_state_postgresql(commit, state_data, state_hash, database)
+            else:
+                result = self._save_apps_state_orm(commit, state_data, state_hash, database)
+
+        if result.created and result.previous_commit:
+            self.save_rollback_diff(commit, result.previous_commit, state_data, result.is_same_snapshot, database)
+
+        return result
+
+    def _save_apps_state_postgresql(self, commit, state_data, state_hash, database):
+        connection = connections[router.db_for_write(AppsState)]
+        sql = SAVE_STATE_SQL_POSTGRESQL.format(
+            state_table=connection.ops.quote_name(AppsState._meta.db_table),
+            snapshot_table=connection.ops.quote_name(MigrationsSnapshot._meta.db_table),
+        )
+        params = {
+            'namespace': self.namespace,
+            'database': database,
+            'commit': commit,
+            'hash': state_hash,
+            # JSON is serialized only if snapshot does not exist
+            'migrations': None,
+            'timestamp': connection.ops.adapt_datetimefield_value(timezone.now()),
+        }
+
+        def execute():
+            cursor.execute(sql, params)
+            return cursor.fetchone()
+
+        with connection.cursor() as cursor:
+            for _ in range(SAVE_STATE_ATTEMPTS):
+                created, timestamp, latest_commit, latest_timestamp, latest_hash, has_snapshot = execute()
+                if timestamp is None and not has_snapshot and params['migrations'] is None:
+                    params['migrations'] = serialize_state(state_data)
+                    created, timestamp, latest_commit, latest_timestamp, latest_hash, has_snapshot = execute()
+
+                # state is inserted by concurrent transaction that was not committed when statement started
+                if timestamp is not None:
+                    break
+
+        if timestamp is None:
+            raise RollbackError(f'Can not save state for commit {commit}.')
+
+        result = partial(SaveStateResult, database, commit, is_same_snapshot=latest_hash == state_hash,
+                         migrations=state_data)
+        if created:
+            return result(True, timestamp, commit, timestamp, previous_commit=latest_commit)
+        return result(False, timestamp, latest_commit, latest_timestamp, previous_commit=None)
+
+    def _save_apps_state_orm(self, commit, state_data, state_hash, database):
+        last_state = self.get_last_apps_state(database)
+        is_same_snapshot = last_state is not None and last_state.snapshot.hash == state_hash
+        result = partial(SaveStateResult, database, commit, is_same_snapshot=is_same_snapshot, migrations=state_data)
+
+        if last_state is not None and last_state.commit == commit:
+            # fast path: state for current commit is the latest, so there is nothing to save
+            return result(False, last_state.timestamp, commit, last_state.timestamp, previous_commit=None)
+
+        # namespace, database and commit are unique together, so get_or_create is safe for parallel calls
+        obj, created = AppsState.objects.get_or_create(
+            namespace=self.namespace, database=database, commit=commit, defaults={
+                'snapshot': lambda: last_state.snapshot if is_same_snapshot else self.get_or_create_snapshot(
+                    state_data, state_hash,
+                ),
+            },
+        )
+        previous_commit = last_state.commit if last_state is not None else None
+        if created:
+            return result(True, obj.timestamp, commit, obj.timestamp, previous_commit=previous_commit)
+        if last_state is None:
+            return result(False, obj.timestamp, commit, obj.timestamp, previous_commit=None)
+        return result(False, obj.timestamp, last_state.commit, last_state.timestamp, previous_commit=None)
+
+    def save_rollback_diff(self, commit, previous_commit, state_data, is_same_snapshot, database=DEFAULT_DB_ALIAS):
+        """
+        precompute diff for rollback from new state to previous one,
+        so rollback to previous commit will not need to load and compare full states
+        """
+        with self.profiler.span('save_rollback_diff'):
+            if is_same_snapshot:
+                records = []
+            else:
+                previous_data = self.get_migrations_data_by_commit(previous_commit, database)
+                records = diff_states(state_data, previous_data).rollback_records
+
+            self.get_states(database).filter(commit=commit).update(
+                previous_commit=previous_commit, rollback_diff=serialize_state(records),
+            )
+
+    @staticmethod
+    def get_or_create_snapshot(state_data, state_hash):
+        snapshot, _ = MigrationsSnapshot.objects.get_or_create(
+            hash=state_hash, defaults={'migrations': lambda: serialize_state(state_data)},
+        )
+        return snapshot
+
+    def search_commit(self, commit, database=DEFAULT_DB_ALIAS):
+        apps_state = self.get_apps_state_by_commit(commit, database=database)
+        return apps_state.commit
+
+    def get_migrations_data_by_commit(self, commit, database=DEFAULT_DB_ALIAS):
+        apps_state = self.get_apps_state_by_commit(commit, with_snapshot=True, database=database)
+        with self.profiler.span('json_decode'):
+            return json.loads(apps_state.snapshot.migrations)
+
+    def make_the_last_state_for_commit(self, commit, database=DEFAULT_DB_ALIAS):
+        """
+        snapshots of deleted states are not deleted, they are reused if migrations return to the same state
+        """
+        apps_state = self.get_apps_state_by_commit(commit, database=database)
+        ids = self.get_states(database).filter(id__gt=apps_state.id).values_list('id', flat=True)
+        self.delete_in_batches(AppsState.objects.all(), list(ids))
+        self.log(f'state for commit {self.get_commit_info(commit)} now is the last state in DB', step='rollback')
+
+    # retention
+
+    def get_states_to_prune(self, keep_last, since, tagged_commits, database=DEFAULT_DB_ALIAS):
+        """
+        states are streamed from newer to older, only ids of states to delete are collected
+        :return ids of states to delete, count of kept states
+        """
+        ids = []
+        kept = 0
+        queryset = self.get_states(database).order_by('-timestamp', '-id') \
+            .values_list('id', 'commit', 'timestamp')
+
+        with self.profiler.span('state_lookup'):
+            for index, (state_id, commit, timestamp) in enumerate(queryset.iterator()):
+                if index < keep_last or (since is not None and timestamp >= since) or commit in tagged_commits:
+                    kept += 1
+                else:
+                    ids.append(state_id)
+
+        return ids, kept
+
+    def delete_in_batches(self, queryset, ids, batch_size=PRUNE_BATCH_SIZE):
+        """
+        delete rows of queryset by ids in bounded batches by raw DELETE, without collector and loading objects,
+        so every statement is short and table is not locked for a long time
+        :return count of deleted rows
+        """
+        using = router.db_for_write(queryset.model)
+        deleted = 0
+        with self.profiler.span('delete'):
+            for start in range(0, len(ids), batch_size):
+                deleted += queryset.filter(id__in=ids[start:start + batch_size])._raw_delete(using)
+        return deleted
+
+    def delete_orphan_snapshots(self, batch_size=PRUNE_BATCH_SIZE, exclude_hashes=()):
+        """
+        snapshot linked to a new state before DELETE statement is kept, because every statement checks it again.
+        It is not safe for save_state that fetched orphan snapshot before DELETE and links it after,
+        such save_state fails by integrity error and should be repeated. Snapshots with `exclude_hashes`
+        (hashes of current migrations) are kept, so save_state of processed databases does not meet this case.
+        """
+        queryset = MigrationsSnapshot.objects.filter(states__isnull=True).exclude(hash__in=exclude_hashes)
+        return self.delete_in_batches(queryset, list(queryset.values_list('id', flat=True)), batch_size)
+
+    # diff
+
+    def get_migrations_diff(self, current, other):
+        """
+        current and other has type list of tuples in format:
+        [(<id> : int, <app> : str, <name> : str), ...]
+        it gets from get_migrations_data_from_commit()
+
+        :return list that indicates what migrations should be executed
+        migration_id is useful to detect migration order (from higher to lower)
+        [
+            namedtuple('MigrationRecord', ['id', 'app', 'name']),
+            ...
+        ]
+        """
+        with self.profiler.span('diff'):
+            result = diff_states(current, other).rollback_records
+
+        self.log_migrations_diff(result)
+        return result
+
+    def get_stored_migrations_diff(self, apps_state, other_commit):
+        """
+        return diff precomputed by save_migrations_state if other commit is the previous state for apps_state,
+        otherwise None (diff should be computed by get_migrations_diff())
+        """
+        if apps_state.rollback_diff is None or apps_state.previous_commit != other_commit:
+            return None
+
+        with self.profiler.span('json_decode'):
+            result = [MigrationRecord(*record) for record in json.loads(apps_state.rollback_diff)]
+
+        self.log_migrations_diff(result)
+        return result
+
+    def log_migrations_diff(self, result):
+        if result:
+            self.log(f'Found migrations diff. In case of rollback need migrate to:\n{result}',
+                     log_level=logging.WARNING, step='diff')
+        else:
+            self.log(f'Diff not found. There is no migrations to rollback.', step='diff')
+
+    def log_states_diff(self, diff):
+        """
+        diff: MigrationsDiff, result of diff_states()
+        """
+        if not diff:
+            self.log('Diff not found. States are equal.')
+            return
+
+        sections = (
+            ('Added apps (rollback to zero)', diff.added),
+            ('Removed apps', diff.removed),
+            ('Moved forward', [f'{change.current} <- {change.other}' for change in diff.moved_forward]),
+            ('Moved backward', [f'{change.current} <- {change.other}' for change in diff.moved_backward]),
+        )
+        for title, items in sections:
+            if items:
+                lines = '\n'.join(f'  {item}' for item in items)
+                self.log(f'{title} ({len(items)}):\n{lines}')
+
+    # rollback
+
+    def validate_current_commit(self, commit, database=DEFAULT_DB_ALIAS):
+        """
+        current commit should be the last commit in DB, otherwise it the migrations state is in inconsistent state,
+        so we can`t run rollback because it may be wrong and it can brake DB state
+        """
+        last_state = self.get_last_apps_state(database)
+        if not last_state:
+            raise self.fail(f'There is no saved states in DB. Rollback procedure impossible.')
+
+        if last_state.commit != commit:
+            raise self.fail(f'Current commit is not the latest in DB. Migrations state may be in inconsistent state. '
+                            f'Rollback procedure impossible.')
+
+        return last_state
+
+    def get_rollback_plan(self, current_commit, other_commit, database=DEFAULT_DB_ALIAS):
+        """
+        :return RollbackPlan with migrations to rollback database from current commit to other commit
+        (or to the previous state if other commit is not specified)
+        """
+        current_state = self.validate_current_commit(current_commit, database)
+
+        if not other_commit:
+            other_commit = self.get_previous_commit(database=database)
+        else:
+            other_commit = self.search_commit(other_commit, database)
+
+        # rollback to the previous state uses diff precomputed by save_migrations_state
+        diff = self.get_stored_migrations_diff(current_state, other_commit)
+        if diff is None:
+            current_data = self.get_migrations_data_by_commit(current_commit, database)
+            other_data = self.get_migrations_data_by_commit(other_commit, database)
+
+            diff = self.get_migrations_diff(current=current_data, other=other_data)
+
+        return RollbackPlan(database, current_commit, other_commit, diff, None)
+
+    def get_resumed_rollback_plans(self):
+        """
+        :return list of RollbackPlan for the last unfinished run of every database,
+        targets are taken from journal, so states and diff are not loaded again
+        """
+        plans = []
+        for database in self.databases:
+            with self.use_database(database):
+                run = self.get_unfinished_rollback_run(database)
+                if run is None:
+                    if self.is_multi_database:
+                        self.log('There is no unfinished rollback run.')
+                    continue
+
+                # state of target commit may be already the last one, if run failed after it was made the last
+                last_state = self.get_last_apps_state(database)
+                if last_state is None or last_state.commit not in (run.current_commit, run.other_commit):
+                    raise self.fail(f'States were changed after rollback run #{run.id} was started. '
+                                    f'Resume procedure impossible.')
+
+                planned = len(json.loads(run.plan)) if run.plan is not None else '?'
+                self.log(f'Resuming rollback run #{run.id} ({run.status}, started {run.started}): '
+                         f'{run.steps.count()} of {planned} planned migrations are already unapplied.',
+                         step='rollback')
+
+                records = [MigrationRecord(*record) for record in json.loads(run.targets)]
+                plans.append(RollbackPlan(database, run.current_commit, run.other_commit, records, run))
+
+        if not plans:
+            raise self.fail('There is no unfinished rollback run to resume.')
+
+        return plans
+
+    def run_rollback_plan(self, plan, fake=False, jobs=1):
+        """
+        progress of not fake rollback is saved to journal (RollbackRun), so it can be resumed if it fails
+        :return RollbackResult, error of rollback is logged and returned in result
+        """
+        started = time.monotonic()
+        error = None
+
+        with self.use_database(plan.database), self.profiler.span('rollback_database', database=plan.database):
+            self.log(f'Running rollback from commit {self.get_commit_info(plan.current_commit)} '
+                     f'to commit {self.get_commit_info(plan.other_commit)}.', step='rollback')
+
+            run = plan.run
+            try:
+                if run is None and not fake:
+                    run = self.start_rollback_run(plan.database, plan.current_commit, plan.other_commit,
+                                                  plan.records)
+
+                self.run_rollback(plan.records, fake=fake, jobs=jobs, database=plan.database, run=run)
+                if not fake:
+                    self.make_the_last_state_for_commit(plan.other_commit, plan.database)
+
+            except Exception as err:
+                if not isinstance(err, RollbackError):
+                    self.log(f'An error occurred while rollback of database `{plan.database}`!',
+                             style='ERROR', log_level=logging.ERROR, exc_info=True)
+                error = err
+
+            if run is not None:
+                self.finish_rollback_run(run, error=error)
+                if error is not None:
+                    self.log(f'Rollback run #{run.id} is failed, use --resume to continue it.',
+                             style='WARNING', log_level=logging.WARNING, step='rollback')
+
+        return RollbackResult(plan.database, plan.current_commit, plan.other_commit, plan.records, error,
+                              int((time.monotonic() - started) * 1000))
+
+    def log_rollback_summary(self, results):
+        lines = []
+        for result in results:
+            if result.error is None:
+                lines.append(f'  {result.database}: OK, {len(result.records)} app(s) to rollback, '
+                             f'{result.duration_ms} ms')
+            else:
+                lines.append(f'  {result.database}: FAILED, {result.duration_ms} ms: '
+                             f'{result.error or "see messages above"}')
+
+        failed = [result for result in results if result.error is not None]
+        message = f'Rollback summary ({len(results) - len(failed)} of {len(results)} databases succeeded):\n'
+        if failed:
+            self.log(message + '\n'.join(lines), style='ERROR', log_level=logging.ERROR, step='rollback')
+        else:
+            self.log(message + '\n'.join(lines), step='rollback')
+
+    def run_rollback(self, migrations_diff_records, fake=False, jobs=1, database=DEFAULT_DB_ALIAS, run=None):
+        """
+        migrations_diff_records: List[MigrationRecord], result of get_migrations_diff()
+        build one combined plan for all records (migration graph is loaded only once) and execute it: backwards part
+        first, then forwards part for apps moved backward after state was saved.
+        If jobs > 1 independent parts of backwards plan are executed concurrently.
+        If run (RollbackRun) is passed, plan and every unapplied migration are saved to its journal.
+        Plan is built from applied migrations, so migrations unapplied by previous attempt of run are skipped.
+        """
+
+        if not migrations_diff_records:
+            self.log('There is no migrations to rollback.')
+            return
+
+        with self.profiler.span('rollback_graph'):
+            executor = RollbackExecutor(connections[database],
+                                        partial(self.migration_progress_callback, database=database, run=run))
+
+        for execute_args in executor.get_commands(migrations_diff_records):
+            self.log(f'Executing command: `{" ".join(execute_args)}`' + (' (executing faked)' if fake else ''),
+                     step='rollback', app=execute_args[1], migration=execute_args[2])
+
+        with self.profiler.span('rollback_plan'):
+            try:
+                plan = executor.get_plan(migrations_diff_records)
+            except RollbackError as err:
+                raise self.fail(str(err), step='rollback')
+
+        if jobs > 1:
+            # only backwards part is executed concurrently, forwards part is executed after it
+            backwards, forwards = executor.split_directions(plan)
+            components = executor.split_plan(backwards) + ([forwards] if forwards else [])
+        else:
+            components = [plan]
+
+        if run is not None:
+            self.save_rollback_run_plan(run, plan)
+
+        if fake:
+            for index, component in enumerate(components, start=1):
+                plan_message = '\n'.join(f'  {"Unapply" if backwards else "Apply"} {migration}'
+                                         for migration, backwards in component)
+                title = f'Migrations plan (group {index} of {len(components)})' if jobs > 1 else 'Migrations plan'
+                self.log(f'{title}:\n{plan_message}')
+            if not plan:
+                self.log('Migrations plan is empty.')
+            return
+
+        if jobs > 1:
+            self.log(f'Running migrations in {min(jobs, len(components))} jobs '
+                     f'({len(components)} independent groups):')
+        else:
+            self.log('Running migrations:')
+
+        self._is_parallel = jobs > 1
+        try:
+            with self.profiler.span('rollback_migrate'):
+                executor.migrate(plan, jobs=jobs)
+        except RollbackError as err:
+            raise self.fail(str(err), step='rollback')
+        finally:
+            self._is_parallel = False
+
+    def migration_progress_callback(self, action, migration=None, fake=False, database=None, run=None):
+        """
+        in parallel mode (several jobs or databases) migrations of several threads are mixed,
+        so only full lines are written to stdout
+        """
+        is_parallel = self._is_parallel or self.is_multi_database
+        if action in ('unapply_start', 'apply_start', 'render_start'):
+            self._step.started = time.monotonic()
+
+        # migrations are applied if target of app is newer than its current migration
+        step, verb, done = ('unapply', 'Unapplying', 'Unapplied') if action.startswith('unapply') else \
+            ('apply', 'Applying', 'Applied')
+
+        if action in ('unapply_start', 'apply_start'):
+            if not is_parallel:
+                self.log_sink.write(f'  {verb} {migration}...')
+        elif action in ('unapply_success', 'apply_success'):
+            span = self.profiler.add_span(step, self.get_step_duration_ms(), app=migration.app_label,
+                                          migration=migration.name, database=database)
+            prefix = f'{self.get_log_prefix(database)}  {verb} {migration}...' if is_parallel else ''
+            self.log_sink.write(prefix + self.log_sink.styled(' OK\n', 'SUCCESS'))
+            self.log_sink.log(f'{done} {migration}', step=step, app=migration.app_label,
+                              migration=migration.name, database=database, duration_ms=int(span.duration_ms))
+            if run is not None:
+                self.save_rollback_checkpoint(run, migration, span.duration_ms)
+        elif action == 'render_start':
+            if not is_parallel:
+                self.log_sink.write('  Rendering model states...')
+        elif action == 'render_success':
+            span = self.profiler.add_span('render', self.get_step_duration_ms(), database=database)
+            if not is_parallel:
+                self.log_sink.write(self.log_sink.styled(' DONE\n', 'SUCCESS'))
+            self.log_sink.log('Rendered model states', log_level=logging.DEBUG, step='render', database=database,
+                              duration_ms=int(span.duration_ms))
+
+    def get_step_duration_ms(self):
+        return (time.monotonic() - self._step.started) * 1000
+
+    # journal
+
+    def start_rollback_run(self, database, current_commit, other_commit, migrations_diff_records):
+        """
+        create journal for new rollback run, previous unfinished runs of database can not be resumed after that
+        """
+        with self.profiler.span('journal'):
+            self.get_rollback_runs(database).filter(status__in=RollbackRun.UNFINISHED_STATUSES) \
+                .update(status=RollbackRun.STATUS_CANCELLED)
+            return RollbackRun.objects.create(namespace=self.namespace, database=database,
+                                              current_commit=current_commit, other_commit=other_commit,
+                                              targets=serialize_state(migrations_diff_records))
+
+    def get_unfinished_rollback_run(self, database=DEFAULT_DB_ALIAS):
+        with self.profiler.span('journal'):
+            return self.get_rollback_runs(database).filter(status__in=RollbackRun.UNFINISHED_STATUSES) \
+                .order_by('-id').first()
+
+    def save_rollback_run_plan(self, run, plan):
+        """
+        the first plan of run is kept, plan of resumed run contains only the remaining migrations
+        """
+        fields = {'status': RollbackRun.STATUS_RUNNING, 'error': None}
+        if run.plan is None:
+            run.plan = fields['plan'] = serialize_state([migration_key(migration) for migration, _ in plan])
+
+        with self.profiler.span('journal'):
+            RollbackRun.objects.filter(id=run.id).update(**fields)
+
+    def save_rollback_checkpoint(self, run, migration, duration_ms):
+        with self.profiler.span('journal'):
+            RollbackStep.objects.create(run_id=run.id, app=migration.app_label, migration=migration.name,
+                                        duration_ms=int(duration_ms))
+
+    def finish_rollback_run(self, run, error=None):
+        """
+        mark run as finished, or as failed if error is passed (so it can be resumed)
+        """
+        with self.profiler.span('journal'):
+            if error is None:
+                RollbackRun.objects.filter(id=run.id).update(status=RollbackRun.STATUS_FINISHED,
+                                                             finished=timezone.now())
+            else:
+                RollbackRun.objects.filter(id=run.id).update(status=RollbackRun.STATUS_FAILED,
+                                                             error=str(error) or repr(error))
+
+
+def save_state(**options):
+    """
+    options are arguments of RollbackService
+    """
+    return RollbackService(**options).save_state()
+
+
+def list_states(limit=None, offset=0, since=None, **options):
+    return list(RollbackService(**options).list_states(limit=limit, offset=offset, since=since))
+
+
+def diff(commit_a, commit_b, database=DEFAULT_DB_ALIAS, **options):
+    options.setdefault('databases', [database])
+    return RollbackService(**options).diff(commit_a, commit_b, database=database)
+
+
+def plan_rollback(commit=None, tag=None, resume=False, **options):
+    return RollbackService(**options).plan_rollback(commit=commit, tag=tag, resume=resume)
+
+
+def rollback(commit=None, tag=None, fake=False, jobs=1, resume=False, **options):
+    return RollbackService(**options).rollback(commit=commit, tag=tag, fake=fake, jobs=jobs, resume=resume)
+
+
+def get_unfinished_runs(**options):
+    return RollbackService(**options).get_unfinished_runs()
+
+
+def prune_states(keep_last=None, keep_days=None, batch_size=PRUNE_BATCH_SIZE, dry_run=False, allow_partial_tags=False,
+                 **options):
+    return RollbackService(**options).prune_states(keep_last, keep_days, batch_size, dry_run, allow_partial_tags)
+
+
+def check_state(**options):
+    return RollbackService(**options).check_state()
+
+
+def to_async(func):
+    """
+    run function in a separate thread by asgiref (it is imported only when async API is used),
+    DB connections of the thread are closed after every call
+    """
+
+    def call(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            connections.close_all()
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        from asgiref.sync import sync_to_async
+
+        return await sync_to_async(call, thread_sensitive=False)(*args, **kwargs)
+
+    return wrapper
+
+
+asave_state = to_async(save_state)
+alist_states = to_async(list_states)
+adiff = to_async(diff)
+aplan_rollback = to_async(plan_rollback)
+arollback = to_async(rollback)
+aget_unfinished_runs = to_async(get_unfinished_runs)
+aprune_states = to_async(prune_states)
+acheck_state = to_async(check_state)
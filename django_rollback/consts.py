@@ -1,3 +1,14 @@
 DEFAULT_REPO_PATH = '.'
 COMMIT_MAX_LENGTH = 40
 MIGRATE_COMMAND = 'migrate'
+ZERO_MIGRATION = 'zero'
+TAGS_CACHE_FILE_NAME = 'django_rollback_tags.json'
+DEFAULT_COMMIT_PROVIDER = 'auto'
+DEFAULT_BUILD_INFO_PATH = 'build-info.json'
+COMMIT_ENV_VARIABLE = 'DJANGO_ROLLBACK_COMMIT'
+TAGS_ENV_VARIABLE = 'DJANGO_ROLLBACK_TAGS'
+SAVE_STATE_ATTEMPTS = 3
+LIST_FORMATS = ('text', 'json', 'csv')
+PRUNE_BATCH_SIZE = 1000
+NAMESPACE_SETTING = 'DJANGO_ROLLBACK_NAMESPACE'
+DEFAULT_NAMESPACE = ''
@@ -0,0 +1,67 @@
+"""
+Diff engine for migrations states.
+States are lists of top migrations for every app in format [(<id> : int, <app> : str, <name> : str), ...]
+"""
+from collections import namedtuple
+
+from django_rollback.consts import ZERO_MIGRATION
+
+MigrationRecord = namedtuple('MigrationRecord', ['id', 'app', 'name'])
+MigrationChange = namedtuple('MigrationChange', ['current', 'other'])
+
+
+class MigrationsDiff(namedtuple('MigrationsDiff', ['added', 'removed', 'moved_forward', 'moved_backward'])):
+    """
+    added: List[MigrationRecord], apps that exist only in current state
+    removed: List[MigrationRecord], apps that exist only in other state
+    moved_forward: List[MigrationChange], apps that have newer top migration in current state than in other
+    moved_backward: List[MigrationChange], apps that have older top migration in current state than in other
+    """
+
+    def __bool__(self):
+        return any(self)
+
+    @property
+    def rollback_records(self):
+        """
+        return list that indicates what migrations should be executed to return from current state to other
+        [MigrationRecord(<id of current top migration>, <app>, <name of other top migration or zero>), ...]
+        """
+        result = [MigrationRecord(record.id, record.app, ZERO_MIGRATION) for record in self.added]
+        for change in self.moved_forward + self.moved_backward:
+            result.append(MigrationRecord(change.current.id, change.current.app, change.other.name))
+        return result
+
+
+def diff_states(current, other):
+    """
+    compare two states in one pass over every state using dict indexed by app
+    """
+    other_by_app = {record[1]: record for record in other}
+
+    added = []
+    moved_forward = []
+    moved_backward = []
+    current_apps = set()
+
+    for record in current:
+        app = record[1]
+        current_apps.add(app)
+
+        other_record = other_by_app.get(app)
+        if other_record is None:
+            added.append(MigrationRecord(*record))
+            continue
+
+        if record[0] == other_record[0] and record[2] == other_record[2]:
+            continue
+
+        change = MigrationChange(MigrationRecord(*record), MigrationRecord(*other_record))
+        if int(record[0]) >= int(other_record[0]):
+            moved_forward.append(change)
+        else:
+            moved_backward.append(change)
+
+    removed = [MigrationRecord(*record) for app, record in other_by_app.items() if app not in current_apps]
+
+    return MigrationsDiff(added, removed, moved_forward, moved_backward)
@@ -0,0 +1,9 @@
+class RollbackError(Exception):
+    """
+    error of save, diff or rollback procedure, the message is already logged when it is raised,
+    results (if any) are typed results of operation for every database
+    """
+
+    def __init__(self, message='', results=None):
+        super().__init__(message)
+        self.results = results
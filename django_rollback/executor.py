@@ -0,0 +1,182 @@
+"""
+Rollback engine built on django MigrationExecutor.
+It loads migration graph and recorder state only once and unapplies all rollback targets by one combined plan,
+instead of running `migrate` command for every app separately.
+"""
+import queue
+import threading
+from importlib import import_module
+
+from django.apps import apps
+from django.core.management.sql import emit_post_migrate_signal, emit_pre_migrate_signal
+from django.db import connections
+from django.db.migrations.executor import MigrationExecutor
+from django.utils.module_loading import module_has_submodule
+
+from django_rollback.consts import MIGRATE_COMMAND, ZERO_MIGRATION
+from django_rollback.exceptions import RollbackError
+
+
+class RollbackExecutor:
+
+    def __init__(self, connection, progress_callback=None, verbosity=1):
+        self.connection = connection
+        self.verbosity = verbosity
+        self.progress_callback = progress_callback
+        self.executor = MigrationExecutor(connection, progress_callback)
+        self.executor.loader.check_consistent_history(connection)
+
+    @property
+    def loader(self):
+        return self.executor.loader
+
+    @staticmethod
+    def get_commands(migrations_diff_records):
+        """
+        return `migrate` command args for every record in the same order as they would be executed one by one
+        (from higher migration.id to lower)
+        """
+        records = sorted(migrations_diff_records, key=lambda r: int(r.id), reverse=True)
+        return [(MIGRATE_COMMAND, record.app, record.name) for record in records]
+
+    def get_targets(self, migrations_diff_records):
+        """
+        translate MigrationRecord list to executor targets in format [(<app>, <name or None for zero>), ...]
+        """
+        targets = []
+        for _, app, name in self.get_commands(migrations_diff_records):
+            if app not in self.loader.migrated_apps:
+                raise RollbackError(f"App '{app}' does not have migrations.")
+
+            if name == ZERO_MIGRATION:
+                targets.append((app, None))
+                continue
+
+            if (app, name) not in self.loader.graph.nodes:
+                raise RollbackError(f"Cannot find a migration matching '{name}' from app '{app}'.")
+
+            targets.append((app, name))
+
+        return targets
+
+    def get_plan(self, migrations_diff_records):
+        """
+        return combined plan for all records: [(<Migration>, <backwards : bool>), ...].
+        Target of app can be newer than its applied migration (app was moved backward after state was saved),
+        django can not execute plan with both directions, so backwards part goes first and forwards part after it,
+        as migrate commands for every app one by one would do
+        """
+        plan = self.executor.migration_plan(self.get_targets(migrations_diff_records))
+        backwards, forwards = self.split_directions(plan)
+        return backwards + forwards
+
+    @staticmethod
+    def split_directions(plan):
+        """
+        :return backwards part and forwards part of plan
+        """
+        return [item for item in plan if item[1]], [item for item in plan if not item[1]]
+
+    def split_plan(self, plan):
+        """
+        split plan to independent components using migration graph: migrations that depend on each other
+        (directly or through other migrations of plan) are in the same component.
+        Components and migrations inside every component keep the order of plan.
+        """
+        keys = [migration_key(migration) for migration, _ in plan]
+        roots = {key: key for key in keys}
+
+        def find(key):
+            while roots[key] != key:
+                roots[key] = roots[roots[key]]
+                key = roots[key]
+            return key
+
+        for key in keys:
+            node = self.loader.graph.node_map[key]
+            for related in node.parents | node.children:
+                if related.key in roots:
+                    roots[find(related.key)] = find(key)
+
+        components = {}
+        for item, key in zip(plan, keys):
+            components.setdefault(find(key), []).append(item)
+        return list(components.values())
+
+    def migrate(self, plan, jobs=1):
+        """
+        execute plan in a single pass for every direction, it is the same that `migrate` command does after plan
+        is built. If jobs > 1, independent components of backwards part are executed concurrently,
+        every one on its own DB connection. Forwards part is executed after backwards part.
+        """
+        # import the 'management' module within each installed app, to register dispatcher events
+        for app_config in apps.get_app_configs():
+            if module_has_submodule(app_config.module, 'management'):
+                import_module('.management', app_config.name)
+
+        pre_migrate_state = self.executor._create_project_state(with_applied_migrations=True)
+        emit_pre_migrate_signal(self.verbosity, False, self.connection.alias, apps=pre_migrate_state.apps, plan=plan)
+
+        backwards, forwards = self.split_directions(plan)
+        post_migrate_state = None
+        if jobs > 1 and backwards:
+            self.migrate_parallel(backwards, jobs)
+        elif backwards:
+            post_migrate_state = self.executor.migrate(None, plan=backwards, state=pre_migrate_state.clone())
+
+        if forwards or post_migrate_state is None:
+            # applied migrations are changed by other connections or by backwards part, so state is rebuilt from DB
+            self.loader.build_graph()
+            if forwards:
+                post_migrate_state = self.executor.migrate(None, plan=forwards)
+            else:
+                post_migrate_state = self.executor._create_project_state(with_applied_migrations=True)
+
+        post_migrate_state.clear_delayed_apps_cache()
+        emit_post_migrate_signal(self.verbosity, False, self.connection.alias, apps=post_migrate_state.apps, plan=plan)
+
+    def migrate_parallel(self, plan, jobs):
+        """
+        every worker thread uses its own DB connection and MigrationExecutor,
+        errors of all components are collected and raised together in the order of components
+        """
+        components = queue.Queue()
+        for index, component in enumerate(self.split_plan(plan)):
+            # direction of every item is kept, plan of worker is built from migrations of its own loader
+            components.put((index, [(migration_key(migration), backwards) for migration, backwards in component]))
+
+        errors = []
+
+        def worker():
+            connection = connections[self.connection.alias]
+            try:
+                executor = MigrationExecutor(connection, self.progress_callback)
+                while True:
+                    try:
+                        index, items = components.get_nowait()
+                    except queue.Empty:
+                        return
+
+                    try:
+                        executor.migrate(None, plan=[(executor.loader.graph.nodes[key], backwards)
+                                                     for key, backwards in items])
+                    except Exception as err:
+                        errors.append((index, items[0][0], err))
+            finally:
+                # connections of this thread (including one for journal) are closed
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker) for _ in range(min(jobs, components.qsize()))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            errors.sort(key=lambda error: error[0])
+            messages = '\n'.join(f'  group of {app}.{name}: {err!r}' for _, (app, name), err in errors)
+            raise RollbackError(f'Rollback failed for {len(errors)} independent group(s) of migrations:\n{messages}')
+
+
+def migration_key(migration):
+    return migration.app_label, migration.name
@@ -0,0 +1,93 @@
+"""
+Streaming log sink for management commands.
+Every event is written to stdout and sent to logger as a separate structured record at the moment it happens,
+so long operations are visible while they are running.
+Without stdout (in-process API) events are sent to logger only.
+"""
+import logging
+import threading
+import time
+import traceback
+
+from django.utils.encoding import force_str
+
+# fields of every log record, available in formatters as %(step)s, %(app)s, etc.
+# database is alias of processed database, elapsed_ms is time since command start,
+# duration_ms is time of the step itself (for example, unapply of migration)
+EVENT_FIELDS = ('step', 'app', 'migration', 'database', 'elapsed_ms', 'duration_ms')
+
+
+class LogSink:
+
+    def __init__(self, stdout=None, logger=None, style=None):
+        self.stdout = stdout
+        self.logger = logger
+        self.style = style
+        self.result_log_level = logging.DEBUG
+        self.started = time.monotonic()
+        self.events_count = {}
+        self._lock = threading.Lock()
+
+    @property
+    def elapsed_ms(self):
+        return int((time.monotonic() - self.started) * 1000)
+
+    def write(self, text):
+        """
+        write text to stdout only (it may be a part of line)
+        """
+        if self.stdout is None:
+            return
+
+        with self._lock:
+            self.stdout.write(text, ending='')
+            self.stdout.flush()
+
+    def event(self, message, style=None, ending='\n', log_level=logging.INFO, exc_info=False, prefix='', **fields):
+        """
+        message is written to stdout (styled by name of style, for example SUCCESS or ERROR) and sent to logger at once,
+        fields (step, app, migration, etc.) are added to log record
+        """
+        if isinstance(message, str) and not message.endswith(ending):
+            message += ending
+
+        output = message
+        if exc_info:
+            output += traceback.format_exc()
+            if not output.endswith(ending):
+                output += ending
+
+        self.write(prefix + self.styled(output, style))
+        self.log(force_str(message).rstrip('\n'), log_level=log_level, exc_info=exc_info, **fields)
+
+    def styled(self, text, style=None):
+        if style is None or self.style is None:
+            return text
+        return force_str(getattr(self.style, style)(text))
+
+    def log(self, message, log_level=logging.INFO, exc_info=False, **fields):
+        """
+        send structured record to logger only
+        """
+        with self._lock:
+            if log_level > self.result_log_level:
+                self.result_log_level = log_level
+
+            level_name = logging.getLevelName(log_level)
+            self.events_count[level_name] = self.events_count.get(level_name, 0) + 1
+
+        if self.logger:
+            extra = {field: fields.get(field) for field in EVENT_FIELDS}
+            if extra['elapsed_ms'] is None:
+                extra['elapsed_ms'] = self.elapsed_ms
+            self.logger.log(log_level, message, exc_info=exc_info, extra=extra)
+
+    def summary(self, message):
+        """
+        send final record with the highest level of all events
+        """
+        events = ', '.join(f'{level}: {count}' for level, count in sorted(self.events_count.items()))
+        if self.logger:
+            extra = {field: None for field in EVENT_FIELDS}
+            extra.update(step='summary', elapsed_ms=self.elapsed_ms)
+            self.logger.log(self.result_log_level, f'{message} Events ({events}).', extra=extra)
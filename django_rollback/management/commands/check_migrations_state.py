@@ -0,0 +1,59 @@
+import logging
+
+from django.core.management.base import CommandError
+
+from django_rollback.api import CHECK_DRIFT, CHECK_MISSING, CHECK_OK
+from django_rollback.diff import diff_states
+from django_rollback.management.base import BaseRollbackCommand
+
+# exit codes of command, 1 is used by django for errors (for example, when current commit can not be identified)
+EXIT_CODES = {
+    CHECK_OK: 0,
+    CHECK_DRIFT: 2,
+    CHECK_MISSING: 3,
+}
+
+
+class Command(BaseRollbackCommand):
+    help = 'Check that current migrations state matches the state saved for current commit without any writes. ' \
+           'Exit codes: 0 - state matches, 1 - error, 2 - migrations differ from saved state, ' \
+           '3 - state for current commit is not saved. It can be used as readiness probe.'
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+
+        parser.add_argument('--log-diff', action='store_true',
+                            help='Log diff between current and saved state if they differ.')
+
+    def _handle(self, *args, **options):
+        results = self.service.check_state()
+
+        for result in results:
+            with self.service.use_database(result.database):
+                self.log_check_result(result, options)
+
+        # exit code is set by django only if command is run from command line, callers of call_command get error
+        exit_code = max(EXIT_CODES[result.status] for result in results)
+        if exit_code:
+            failed = ', '.join(f'{result.database} ({result.status})'
+                               for result in results if result.status != CHECK_OK)
+            raise CommandError(f'Migrations state check failed for databases: {failed}.', returncode=exit_code)
+
+    def log_check_result(self, result, options):
+        """
+        commit is printed without tags, so tags map is not loaded
+        """
+        if result.status == CHECK_OK:
+            self.add_log(f'Migrations state matches saved state for commit "{result.commit}".', style='SUCCESS',
+                         step='check')
+
+        elif result.status == CHECK_MISSING:
+            self.add_log(f'State for current commit "{result.commit}" is not saved.', style='ERROR',
+                         log_level=logging.ERROR, step='check')
+
+        else:
+            self.add_log(f'Migrations state differs from saved state for commit "{result.commit}".', style='ERROR',
+                         log_level=logging.ERROR, step='check')
+            if options['log_diff']:
+                stored_data = self.service.get_migrations_data_by_commit(result.commit, result.database)
+                self.service.log_states_diff(diff_states(result.migrations, stored_data))
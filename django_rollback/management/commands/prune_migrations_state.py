@@ -0,0 +1,42 @@
+from django.core.management.base import CommandError
+
+from django_rollback.consts import PRUNE_BATCH_SIZE
+from django_rollback.management.base import BaseRollbackCommand
+
+
+class Command(BaseRollbackCommand):
+    help = 'Delete old migrations states by retention policies. States of tagged commits and the latest state ' \
+           'are always kept. Keep at least 2 last states to be able to rollback to previous state.'
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+
+        parser.add_argument('--keep-last', type=int, help='Count of the last states to keep.')
+        parser.add_argument('--keep-days', type=int, help='Keep states created during the last days.')
+        parser.add_argument('--batch-size', type=int, default=PRUNE_BATCH_SIZE,
+                            help=f'Count of rows deleted by one statement. Default is {PRUNE_BATCH_SIZE}.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Print count of states to delete without deleting them.')
+        parser.add_argument('--allow-partial-tags', action='store_true',
+                            help='Run with provider that knows only tags of current commit (env, arg or build info '
+                                 'file with list of tags), states of other tagged commits may be deleted.')
+
+    def _handle(self, *args, **options):
+        if options['keep_last'] is None and options['keep_days'] is None:
+            raise CommandError('At least one of --keep-last or --keep-days arguments should be set.')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size should be positive.')
+
+        results = self.service.prune_states(keep_last=options['keep_last'], keep_days=options['keep_days'],
+                                            batch_size=options['batch_size'], dry_run=options['dry_run'],
+                                            allow_partial_tags=options['allow_partial_tags'])
+
+        for result in results:
+            with self.service.use_database(result.database):
+                if options['dry_run']:
+                    self.add_log(f'{result.deleted} state(s) would be deleted, {result.kept} state(s) would be kept.',
+                                 step='prune')
+                else:
+                    self.add_log(f'{result.deleted} state(s) deleted, {result.kept} state(s) kept, '
+                                 f'{result.snapshots_deleted} unused snapshot(s) deleted.', style='SUCCESS',
+                                 step='prune')
@@ -1,10 +1,15 @@
+import csv
+import datetime
+import json
 import logging
 
-import git
+from django.conf import settings
 from django.core.management.base import CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 
+from django_rollback.consts import LIST_FORMATS
 from django_rollback.management.base import BaseRollbackCommand
-from django_rollback.models import AppsState
 
 
 class Command(BaseRollbackCommand):
@@ -22,6 +27,20 @@ class Command(BaseRollbackCommand):
         parser.add_argument('--fake', action='store_true',
                             help='It allow to only print info about processed actions without execution '
                                  '(no changes for DB).')
+        parser.add_argument('-j', '--jobs', type=int, default=1,
+                            help='Number of concurrent jobs to unapply independent groups of migrations '
+                                 '(every job uses its own DB connection).')
+        parser.add_argument('--resume', action='store_true',
+                            help='Continue the last failed or interrupted rollback from the last checkpoint.')
+        parser.add_argument('--status', action='store_true', help='Show failed or interrupted rollback runs.')
+        parser.add_argument('--diff', nargs=2, metavar=('COMMIT_A', 'COMMIT_B'),
+                            help='Show the diff between two stored states (what changed in A relative to B).')
+        parser.add_argument('--limit', type=int, help='Show only LIMIT newest states (for --list).')
+        parser.add_argument('--offset', type=int, default=0, help='Skip OFFSET newest states (for --list).')
+        parser.add_argument('--since', type=str,
+                            help='Show only states created since date or datetime in ISO format (for --list).')
+        parser.add_argument('--format', type=str, choices=LIST_FORMATS, default=LIST_FORMATS[0],
+                            help='Output format (for --list).')
 
     def validate_arguments(self, options):
         list_arg = options['list']
@@ -29,104 +48,148 @@ class Command(BaseRollbackCommand):
         commit_arg = options['commit']
         fake_arg = options['fake']
 
-        if list_arg and (tag_arg is not None or commit_arg is not None or fake_arg):
-            self.add_log(f'--list arg should be used without git args (tag, commit or fake).',
+        diff_arg = options['diff']
+
+        if list_arg and (tag_arg is not None or commit_arg is not None or fake_arg or diff_arg):
+            self.add_log(f'--list arg should be used without git args (tag, commit, fake or diff).',
+                         log_level=logging.ERROR)
+            raise CommandError()
+
+        if diff_arg and (tag_arg is not None or commit_arg is not None or fake_arg):
+            self.add_log(f'--diff arg should be used without git args (tag, commit or fake).',
                          log_level=logging.ERROR)
             raise CommandError()
 
+        if (options['resume'] or options['status']) and (tag_arg is not None or commit_arg is not None or fake_arg
+                                                          or list_arg or diff_arg):
+            self.add_log(f'--resume and --status args should be used without tag, commit, fake, list or diff args.',
+                         log_level=logging.ERROR)
+            raise CommandError()
+
+        if options['resume'] and options['status']:
+            self.add_log(f'--resume and --status args can not used together.', log_level=logging.ERROR)
+            raise CommandError()
+
         if tag_arg is not None and commit_arg is not None:
             self.add_log(f'tag and commit args can not used together.', log_level=logging.ERROR)
             raise CommandError()
 
-    def validate_current_commit(self, commit):
-        """
-        current commit should be the last commit in DB, otherwise it the migrations state is in inconsistent state,
-        so we can`t run rollback because it may be wrong and it can brake DB state
-        """
-        last_state = self.get_last_apps_state()
-        if not last_state:
-            self.add_log(f'There is no saved states in DB. Rollback procedure impossible.', log_level=logging.ERROR)
+        if options['jobs'] < 1:
+            self.add_log(f'jobs arg should be positive.', log_level=logging.ERROR)
+            raise CommandError()
+
+        is_list_option_used = (options['limit'] is not None or options['offset'] or options['since'] is not None
+                               or options['format'] != LIST_FORMATS[0])
+        if is_list_option_used and not list_arg:
+            self.add_log(f'limit, offset, since and format args can be used only with --list arg.',
+                         log_level=logging.ERROR)
             raise CommandError()
 
-        if last_state.commit != commit:
-            message = f'Current commit is not the latest in DB. Migrations state may be in inconsistent state. ' \
-                      f'Rollback procedure impossible.'
-            self.add_log(message, log_level=logging.ERROR)
+        if options['limit'] is not None and options['limit'] < 0 or options['offset'] < 0:
+            self.add_log(f'limit and offset args should not be negative.', log_level=logging.ERROR)
+            raise CommandError()
+
+        if options['since'] is not None and self.parse_since(options['since']) is None:
+            self.add_log(f'since arg should be a date or datetime in ISO format.', log_level=logging.ERROR)
             raise CommandError()
 
     def _handle(self, *args, **options):
         self.validate_arguments(options)
 
         if options['list']:
-            return self.print_states_list()
-
-        if options['fake']:
-            self.add_log('Running rollback with --fake option.', style_func=self.style.WARNING,
-                         log_level=logging.WARNING)
-
-        current_commit = self.get_current_commit()
-        self.validate_current_commit(current_commit)
+            return self.print_states_list(limit=options['limit'], offset=options['offset'],
+                                          since=self.parse_since(options['since']), output_format=options['format'])
 
-        other_commit = self.get_other_commit(options)
-        if not other_commit:
-            other_commit = self.get_previous_commit()
-        else:
-            other_commit = self.search_commit(other_commit)
+        if options['diff']:
+            for database in self.service.databases:
+                with self.service.use_database(database):
+                    self.print_states_diff(*options['diff'], database=database)
+            return
 
-        current_data = self.get_migrations_data_by_commit(current_commit)
-        other_data = self.get_migrations_data_by_commit(other_commit)
+        if options['status']:
+            return self.print_rollback_runs()
 
-        diff = self.get_migrations_diff(current=current_data, other=other_data)
-
-        self.add_log(f'Running rollback from commit {self.get_commit_info(current_commit)} '
-                     f'to commit {self.get_commit_info(other_commit)}.')
+        if options['fake']:
+            self.add_log('Running rollback with --fake option.', style='WARNING', log_level=logging.WARNING)
 
-        self.run_rollback(diff, fake=options['fake'])
-        if not options['fake']:
-            self.make_the_last_state_for_commit(other_commit)
+        plans = self.service.plan_rollback(commit=options['commit'], tag=options['tag'], resume=options['resume'])
+        self.service.rollback(plans, fake=options['fake'], jobs=options['jobs'])
 
         fake_msg = ' with `--fake` option' if options['fake'] else ''
-        self.add_log(f'Rollback successfully finished{fake_msg}.', style_func=self.style.SUCCESS)
-
-    def get_other_commit(self, options):
-        commit_arg = options['commit']
-        tag_arg = options['tag']
-
-        if commit_arg:
-            return commit_arg
-
-        if tag_arg:
-            try:
-                repo = git.Repo(self._repo_path)
-                if tag_arg not in repo.tags:
-                    self.add_log(f'Can not find tag `{tag_arg}` in git repository.', log_level=logging.ERROR)
-                    raise CommandError()
-
-                return repo.tags[tag_arg].commit.hexsha
-
-            except CommandError as err:
-                raise err
-
-            except Exception as err:
-                self.add_log(f'An error occurred while working with git repo!', style_func=self.style.ERROR,
-                             log_level=logging.ERROR, exc_info=True)
-                raise CommandError(err)
-
-        return None
-
-    def print_states_list(self,):
-        format_string = '{:>8}  {:<20}   {:<40}   {}'  # timestamp commit tag
-
-        current_commit = self.get_current_commit()
+        self.add_log(f'Rollback successfully finished{fake_msg}.', style='SUCCESS', step='rollback')
+
+    @staticmethod
+    def parse_since(value):
+        if value is None:
+            return None
+
+        try:
+            since = parse_datetime(value)
+            if since is None:
+                since_date = parse_date(value)
+                since = datetime.datetime.combine(since_date, datetime.time()) if since_date else None
+        except ValueError:
+            return None
+
+        if since is not None and settings.USE_TZ and timezone.is_naive(since):
+            since = timezone.make_aware(since)
+        return since
+
+    def print_states_list(self, limit=None, offset=0, since=None, output_format=LIST_FORMATS[0]):
+        states = self.service.list_states(limit=limit, offset=offset, since=since)
+        with self.profiler.span('list'):
+            getattr(self, f'_print_states_list_{output_format}')(states)
+
+    def _print_states_list_text(self, states):
+        # database column is printed only if states of several databases are listed
+        is_multi_database = self.service.is_multi_database
+        format_string = '{:>8}  {:<20}   {:<40}   {}' if not is_multi_database else \
+            '{:>8}  {:<20}   {:<40}   {:<16}   {}'  # timestamp commit [database] tag
+        database_column = ['DATABASE'] if is_multi_database else []
 
         self.stdout.write(f'Saved states in database sorted from newer to older:')
-        self.stdout.write(format_string.format('MARK    ', 'TIMESTAMP v', 'COMMIT', 'TAGS'))
-
-        queryset = AppsState.objects.all().order_by('-timestamp')
-        for state in queryset:
-            current_mark = 'curr >>>' if state.commit == current_commit else ''
-            commit_tags = sorted(self.repo_tags.get(state.commit, []), reverse=True)
-            commit_tags = ', '.join(commit_tags) if commit_tags else ''
-            self.stdout.write(
-                f'{format_string.format(current_mark, str(state.timestamp)[:19], state.commit, commit_tags)}'
-            )
+        self.stdout.write(format_string.format('MARK    ', 'TIMESTAMP v', 'COMMIT', *database_column, 'TAGS'))
+
+        for state in states:
+            current_mark = 'curr >>>' if state.is_current else ''
+            database_column = [state.database] if is_multi_database else []
+            self.stdout.write(format_string.format(current_mark, str(state.timestamp)[:19], state.commit,
+                                                   *database_column, ', '.join(state.tags)))
+
+    def _print_states_list_json(self, states):
+        self.stdout.write('[')
+        for index, state in enumerate(states):
+            item = json.dumps({'current': state.is_current, 'timestamp': state.timestamp.isoformat(),
+                               'commit': state.commit, 'tags': state.tags, 'database': state.database})
+            self.stdout.write(f'{"," if index else ""}{item}')
+        self.stdout.write(']')
+
+    def _print_states_list_csv(self, states):
+        writer = csv.writer(self.stdout, lineterminator='\n')
+        writer.writerow(['current', 'timestamp', 'commit', 'tags', 'database'])
+        for state in states:
+            writer.writerow([int(state.is_current), state.timestamp.isoformat(), state.commit, ' '.join(state.tags),
+                             state.database])
+
+    def print_states_diff(self, commit_a, commit_b, database):
+        result = self.service.diff(commit_a, commit_b, database=database)
+
+        self.add_log(f'Diff for commit {self.service.get_commit_info(result.commit_a)} '
+                     f'relative to commit {self.service.get_commit_info(result.commit_b)}:')
+        self.service.log_states_diff(result.diff)
+
+    def print_rollback_runs(self):
+        runs = self.service.get_unfinished_runs()
+        if not runs:
+            self.stdout.write('There is no failed or interrupted rollback runs.')
+            return
+
+        self.stdout.write('Failed or interrupted rollback runs sorted from newer to older:')
+        for run in runs:
+            self.stdout.write(f'#{run.id} [{run.database}] {run.status}, started {str(run.started)[:19]}, '
+                              f'from {self.service.get_commit_info(run.current_commit)} '
+                              f'to {self.service.get_commit_info(run.other_commit)}: '
+                              f'{run.unapplied} of {run.planned if run.planned is not None else "?"} '
+                              f'migrations unapplied')
+            if run.error:
+                self.stdout.write(f'  Error: {run.error}')
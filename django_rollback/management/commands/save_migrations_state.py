@@ -1,8 +1,6 @@
-import json
 import logging
 
 from django_rollback.management.base import BaseRollbackCommand
-from django_rollback.models import AppsState
 
 
 class Command(BaseRollbackCommand):
@@ -17,39 +15,50 @@ class Command(BaseRollbackCommand):
         parser.add_argument('--log-diff', action='store_true', help='Log current diff for current and previous state.')
 
     def _handle(self, *args, **options):
-        commit = self.get_current_commit()
-        state_data = self.get_current_migrations_state()
+        for result in self.service.save_state():
+            with self.service.use_database(result.database):
+                self.log_save_result(result, options)
 
-        obj, created = AppsState.objects.get_or_create(commit=commit, defaults={'migrations': json.dumps(state_data)})
-        last_state = self.get_last_apps_state()
-        if created:
-            message = f'State successfully created for commit {self.get_commit_info(commit)}.'
+    def log_save_result(self, result, options):
+        """
+        result: SaveStateResult of one database
+        """
+        service = self.service
+        commit = result.commit
+
+        if result.created:
+            message = f'State successfully created for commit {service.get_commit_info(commit)}.'
+            if result.is_same_snapshot:
+                message += ' Migrations are not changed since previous state.'
             if options['log_full_data']:
-                message += f'\nData = {state_data}'
-            self.add_log(message, style_func=self.style.SUCCESS)
+                message += f'\nData = {result.migrations}'
+            self.add_log(message, style='SUCCESS', step='save')
 
         else:
-            if commit == last_state.commit:
-                message = (f'State for current commit {self.get_commit_info(commit)} already exists. '
-                           f'Created {obj.timestamp}\n'
+            if commit == result.latest_commit:
+                message = (f'State for current commit {service.get_commit_info(commit)} already exists. '
+                           f'Created {result.timestamp}\n'
                            f'This is the latest state for this service. So all is fine.'
                            )
                 if options['log_full_data']:
-                    message += f'\nData = {last_state.migrations}'
-                self.add_log(message, style_func=self.style.SUCCESS)
+                    message += f'\nData = {service.get_migrations_data_by_commit(commit, result.database)}'
+                self.add_log(message, style='SUCCESS', step='save')
 
             else:
                 message = (
-                    f'State for current commit {self.get_commit_info(commit)} already exists. Created {obj.timestamp}\n'
+                    f'State for current commit {service.get_commit_info(commit)} already exists. '
+                    f'Created {result.timestamp}\n'
                     f'This is NOT the latest state for this service.\n'
-                    f'Latest: commit {self.get_commit_info(last_state.commit)}, created {last_state.timestamp}.\n'
+                    f'Latest: commit {service.get_commit_info(result.latest_commit)}, '
+                    f'created {result.latest_timestamp}.\n'
                     f'Did you forget to perform rollback before changing service version? '
                     f'So migrations may be in inconsistent state, please check it!'
                 )
-                self.add_log(message, style_func=self.style.WARNING, log_level=logging.WARNING)
+                self.add_log(message, style='WARNING', log_level=logging.WARNING, step='save')
 
         if options['log_diff']:
-            other_commit = self.get_previous_commit(raise_exception=False)  # it will log if only one state in DB
+            # it will log if only one state in DB
+            other_commit = service.get_previous_commit(raise_exception=False, database=result.database)
             if other_commit:
-                other_data = self.get_migrations_data_by_commit(other_commit)
-                self.get_migrations_diff(current=state_data, other=other_data)  # it has diff log inside
+                other_data = service.get_migrations_data_by_commit(other_commit, result.database)
+                service.get_migrations_diff(current=result.migrations, other=other_data)  # it has diff log inside
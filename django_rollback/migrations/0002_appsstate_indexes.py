@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def normalize_commits(apps, schema_editor):
+    """
+    commits are looked up by lowercase prefix, so stored values should be lowercase too,
+    and duplicated commits should be removed before unique constraint is added (the latest record is kept)
+    """
+    AppsState = apps.get_model('django_rollback', 'AppsState')
+    db_alias = schema_editor.connection.alias
+
+    seen = set()
+    for state in AppsState.objects.using(db_alias).order_by('-id').only('id', 'commit'):
+        commit = state.commit.lower()
+        if commit in seen:
+            state.delete()
+            continue
+
+        seen.add(commit)
+        if commit != state.commit:
+            AppsState.objects.using(db_alias).filter(id=state.id).update(commit=commit)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_rollback', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_commits, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='appsstate',
+            name='commit',
+            field=models.CharField(help_text='Hex sha of commit.', max_length=40, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='appsstate',
+            index=models.Index(fields=['timestamp', 'id'], name='django_roll_timesta_2c9a4e_idx'),
+        ),
+    ]
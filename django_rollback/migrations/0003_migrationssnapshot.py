@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from django_rollback.snapshots import get_state_hash
+
+
+def create_snapshots(apps, schema_editor):
+    AppsState = apps.get_model('django_rollback', 'AppsState')
+    MigrationsSnapshot = apps.get_model('django_rollback', 'MigrationsSnapshot')
+    db_alias = schema_editor.connection.alias
+
+    snapshots = {}
+    for state in AppsState.objects.using(db_alias).order_by('id').only('id', 'migrations').iterator():
+        state_hash = get_state_hash(json.loads(state.migrations))
+        if state_hash not in snapshots:
+            snapshot, _ = MigrationsSnapshot.objects.using(db_alias).get_or_create(
+                hash=state_hash, defaults={'migrations': state.migrations},
+            )
+            snapshots[state_hash] = snapshot.id
+
+        AppsState.objects.using(db_alias).filter(id=state.id).update(snapshot_id=snapshots[state_hash])
+
+
+def restore_migrations(apps, schema_editor):
+    AppsState = apps.get_model('django_rollback', 'AppsState')
+    MigrationsSnapshot = apps.get_model('django_rollback', 'MigrationsSnapshot')
+    db_alias = schema_editor.connection.alias
+
+    for snapshot in MigrationsSnapshot.objects.using(db_alias).iterator():
+        AppsState.objects.using(db_alias).filter(snapshot_id=snapshot.id).update(migrations=snapshot.migrations)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_rollback', '0002_appsstate_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MigrationsSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hash', models.CharField(help_text='sha256 of migrations state.', max_length=64, unique=True)),
+                ('migrations', models.TextField(help_text='JSON text for current top migrations [(id, app, name), ...] for app state')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='appsstate',
+            name='snapshot',
+            field=models.ForeignKey(help_text='Migrations state for commit.', null=True,
+                                    on_delete=django.db.models.deletion.PROTECT, related_name='states',
+                                    to='django_rollback.MigrationsSnapshot'),
+        ),
+        migrations.AlterField(
+            model_name='appsstate',
+            name='migrations',
+            field=models.TextField(help_text='JSON text for current top migrations [(id, app, name), ...] for app state', null=True),
+        ),
+        migrations.RunPython(create_snapshots, restore_migrations),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """
+    schema changes are separated from data migration in 0003,
+    so ALTER TABLE is not executed in the same transaction with updated rows
+    """
+
+    dependencies = [
+        ('django_rollback', '0003_migrationssnapshot'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='appsstate',
+            name='migrations',
+        ),
+        migrations.AlterField(
+            model_name='appsstate',
+            name='snapshot',
+            field=models.ForeignKey(help_text='Migrations state for commit.',
+                                    on_delete=django.db.models.deletion.PROTECT, related_name='states',
+                                    to='django_rollback.MigrationsSnapshot'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_rollback', '0004_remove_appsstate_migrations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appsstate',
+            name='previous_commit',
+            field=models.CharField(blank=True, help_text='Hex sha of commit of the latest state when this state was saved.', max_length=40, null=True),
+        ),
+        migrations.AddField(
+            model_name='appsstate',
+            name='rollback_diff',
+            field=models.TextField(blank=True, help_text='JSON text for migrations to rollback to previous state [(id, app, name), ...]', null=True),
+        ),
+    ]
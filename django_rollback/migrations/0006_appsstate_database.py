@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_rollback', '0005_appsstate_rollback_diff'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appsstate',
+            name='database',
+            field=models.CharField(default='default', help_text='Alias of database which migrations state is stored.', max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='appsstate',
+            name='commit',
+            field=models.CharField(db_index=True, help_text='Hex sha of commit.', max_length=40),
+        ),
+        migrations.AlterUniqueTogether(
+            name='appsstate',
+            unique_together={('database', 'commit')},
+        ),
+        migrations.RemoveIndex(
+            model_name='appsstate',
+            name='django_roll_timesta_2c9a4e_idx',
+        ),
+        migrations.AddIndex(
+            model_name='appsstate',
+            index=models.Index(fields=['database', 'timestamp', 'id'], name='django_roll_databas_7d41f0_idx'),
+        ),
+    ]
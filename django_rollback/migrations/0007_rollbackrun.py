@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_rollback', '0006_appsstate_database'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollbackRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('database', models.CharField(help_text='Alias of database which is rolled back.', max_length=100)),
+                ('current_commit', models.CharField(help_text='Hex sha of commit of the latest state before rollback.', max_length=40)),
+                ('other_commit', models.CharField(help_text='Hex sha of commit of target state.', max_length=40)),
+                ('targets', models.TextField(help_text='JSON text for migrations to rollback [(id, app, name), ...]')),
+                ('plan', models.TextField(blank=True, help_text='JSON text for planned migrations to unapply [(app, name), ...]', null=True)),
+                ('status', models.CharField(choices=[('running', 'Running'), ('failed', 'Failed'), ('finished', 'Finished'), ('cancelled', 'Cancelled')], default='running', max_length=16)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('started', models.DateTimeField(auto_now_add=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RollbackStep',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('app', models.CharField(max_length=255)),
+                ('migration', models.CharField(help_text='Name of unapplied migration.', max_length=255)),
+                ('duration_ms', models.IntegerField()),
+                ('timestamp', models.DateTimeField(auto_now_add=True)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='steps', to='django_rollback.RollbackRun')),
+            ],
+        ),
+    ]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_rollback', '0007_rollbackrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appsstate',
+            name='namespace',
+            field=models.CharField(blank=True, default='', help_text='Name of service, states of services that share one database are separated by it.', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='rollbackrun',
+            name='namespace',
+            field=models.CharField(blank=True, default='', help_text='Name of service.', max_length=100),
+        ),
+        migrations.AlterUniqueTogether(
+            name='appsstate',
+            unique_together={('namespace', 'database', 'commit')},
+        ),
+        migrations.RemoveIndex(
+            model_name='appsstate',
+            name='django_roll_databas_7d41f0_idx',
+        ),
+        migrations.AddIndex(
+            model_name='appsstate',
+            index=models.Index(fields=['namespace', 'database', 'timestamp', 'id'], name='django_roll_namespa_667312_idx'),
+        ),
+    ]
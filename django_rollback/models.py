@@ -1,8 +1,72 @@
-from django.db import models
+from django.db import DEFAULT_DB_ALIAS, models
 
 
-class AppsState(models.Model):
-    commit = models.CharField(max_length=40, help_text='Hex sha of commit.')
+class MigrationsSnapshot(models.Model):
+    hash = models.CharField(max_length=64, unique=True, help_text='sha256 of migrations state.')
     migrations = models.TextField(help_text='JSON text for current top migrations [(id, app, name), ...]'
                                             ' for app state')
+
+
+class AppsState(models.Model):
+    namespace = models.CharField(max_length=100, default='', blank=True,
+                                 help_text='Name of service, states of services that share one database '
+                                           'are separated by it.')
+    database = models.CharField(max_length=100, default=DEFAULT_DB_ALIAS,
+                                help_text='Alias of database which migrations state is stored.')
+    commit = models.CharField(max_length=40, db_index=True, help_text='Hex sha of commit.')
+    snapshot = models.ForeignKey(MigrationsSnapshot, on_delete=models.PROTECT, related_name='states',
+                                 help_text='Migrations state for commit.')
+    timestamp = models.DateTimeField(auto_now_add=True)
+    previous_commit = models.CharField(max_length=40, null=True, blank=True,
+                                       help_text='Hex sha of commit of the latest state when this state was saved.')
+    rollback_diff = models.TextField(null=True, blank=True,
+                                     help_text='JSON text for migrations to rollback to previous state '
+                                               '[(id, app, name), ...]')
+
+    class Meta:
+        unique_together = [('namespace', 'database', 'commit')]
+        indexes = [
+            models.Index(fields=['namespace', 'database', 'timestamp', 'id'], name='django_roll_namespa_667312_idx'),
+        ]
+
+    @property
+    def migrations(self):
+        return self.snapshot.migrations
+
+
+class RollbackRun(models.Model):
+    """
+    journal of rollback run for one database, every unapplied migration is saved as RollbackStep (checkpoint),
+    so failed or interrupted run can be resumed
+    """
+    STATUS_RUNNING = 'running'
+    STATUS_FAILED = 'failed'
+    STATUS_FINISHED = 'finished'
+    STATUS_CANCELLED = 'cancelled'
+    STATUS_CHOICES = (
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_FAILED, 'Failed'),
+        (STATUS_FINISHED, 'Finished'),
+        (STATUS_CANCELLED, 'Cancelled'),
+    )
+    UNFINISHED_STATUSES = (STATUS_RUNNING, STATUS_FAILED)
+
+    namespace = models.CharField(max_length=100, default='', blank=True, help_text='Name of service.')
+    database = models.CharField(max_length=100, help_text='Alias of database which is rolled back.')
+    current_commit = models.CharField(max_length=40, help_text='Hex sha of commit of the latest state before rollback.')
+    other_commit = models.CharField(max_length=40, help_text='Hex sha of commit of target state.')
+    targets = models.TextField(help_text='JSON text for migrations to rollback [(id, app, name), ...]')
+    plan = models.TextField(null=True, blank=True,
+                            help_text='JSON text for planned migrations to unapply [(app, name), ...]')
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_RUNNING)
+    error = models.TextField(null=True, blank=True)
+    started = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+
+class RollbackStep(models.Model):
+    run = models.ForeignKey(RollbackRun, on_delete=models.CASCADE, related_name='steps')
+    app = models.CharField(max_length=255)
+    migration = models.CharField(max_length=255, help_text='Name of unapplied migration.')
+    duration_ms = models.IntegerField()
     timestamp = models.DateTimeField(auto_now_add=True)
@@ -0,0 +1,48 @@
+"""
+Timing instrumentation for management commands.
+Every span is sent by `span_finished` signal, so timings can be forwarded to metrics pipeline.
+"""
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from django_rollback.signals import span_finished
+
+Span = namedtuple('Span', ['name', 'duration_ms', 'tags'])
+
+
+class Profiler:
+
+    def __init__(self, sender=None):
+        self.sender = sender
+        self.spans = []
+
+    @contextmanager
+    def span(self, name, **tags):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add_span(name, (time.monotonic() - started) * 1000, **tags)
+
+    def add_span(self, name, duration_ms, **tags):
+        span = Span(name, duration_ms, tags)
+        self.spans.append(span)
+        span_finished.send(sender=self.sender, span=span)
+        return span
+
+    def get_report(self):
+        """
+        return list of tuples (<name>, <count>, <total ms>, <max ms>) sorted by total time from higher to lower
+        """
+        result = {}
+        for span in self.spans:
+            count, total, maximum = result.get(span.name, (0, 0, 0))
+            result[span.name] = (count + 1, total + span.duration_ms, max(maximum, span.duration_ms))
+
+        report = [(name, count, total, maximum) for name, (count, total, maximum) in result.items()]
+        return sorted(report, key=lambda r: r[2], reverse=True)
+
+    def get_slowest(self, name, limit=10):
+        return sorted((span for span in self.spans if span.name == name),
+                      key=lambda s: s.duration_ms, reverse=True)[:limit]
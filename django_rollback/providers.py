@@ -0,0 +1,200 @@
+"""
+Providers of current commit and tags map.
+GitPython is imported only when git provider is selected, so other providers work without git metadata.
+"""
+import json
+import os
+import re
+
+from django_rollback.consts import COMMIT_ENV_VARIABLE, TAGS_ENV_VARIABLE
+
+COMMIT_RE = re.compile(r'^[0-9a-fA-F]{4,40}$')
+
+
+class ProviderError(Exception):
+    pass
+
+
+class BaseCommitProvider:
+    name = None
+    # provider knows tags of all commits of repository, not only tags of current commit
+    has_repository_tags = False
+
+    def get_current_commit(self):
+        raise NotImplementedError('subclasses of BaseCommitProvider must provide a get_current_commit() method')
+
+    @property
+    def tags(self):
+        """
+        return map {<tag name> : <commit hexsha>}
+        """
+        return {}
+
+    @property
+    def commits_tags(self):
+        """
+        return map {<commit hexsha> : [<tag name>, ...]}
+        """
+        result = {}
+        for tag, commit in self.tags.items():
+            result.setdefault(commit, [])
+            result[commit].append(tag)
+        return result
+
+    def get_tag_commit(self, tag):
+        return self.tags.get(tag)
+
+    @staticmethod
+    def validate_commit(commit, source):
+        commit = (commit or '').strip()
+        if not COMMIT_RE.match(commit):
+            raise ProviderError(f'Invalid commit hash `{commit}` in {source}.')
+        return commit.lower()
+
+
+class GitCommitProvider(BaseCommitProvider):
+    name = 'git'
+    has_repository_tags = True
+
+    def __init__(self, path):
+        # GitPython is imported only when git provider is used
+        from django_rollback.repo import GitRepository
+
+        self.repo = GitRepository(path)
+
+    def get_current_commit(self):
+        return self.repo.get_head_commit()
+
+    @property
+    def tags(self):
+        return self.repo.tags
+
+    @property
+    def commits_tags(self):
+        return self.repo.commits_tags
+
+
+class EnvironmentCommitProvider(BaseCommitProvider):
+    """
+    commit is read from DJANGO_ROLLBACK_COMMIT variable,
+    optional comma separated tags of current commit are read from DJANGO_ROLLBACK_TAGS variable
+    """
+    name = 'env'
+
+    def __init__(self, environ=None):
+        self.environ = os.environ if environ is None else environ
+
+    @classmethod
+    def is_available(cls):
+        return bool(os.environ.get(COMMIT_ENV_VARIABLE))
+
+    def get_current_commit(self):
+        if not self.environ.get(COMMIT_ENV_VARIABLE):
+            raise ProviderError(f'Environment variable {COMMIT_ENV_VARIABLE} is not set.')
+        return self.validate_commit(self.environ[COMMIT_ENV_VARIABLE], f'{COMMIT_ENV_VARIABLE} variable')
+
+    @property
+    def tags(self):
+        tags = [tag.strip() for tag in self.environ.get(TAGS_ENV_VARIABLE, '').split(',') if tag.strip()]
+        if not tags:
+            return {}
+
+        commit = self.get_current_commit()
+        return {tag: commit for tag in tags}
+
+
+class BuildInfoCommitProvider(BaseCommitProvider):
+    """
+    commit is read from the file baked into image during build. Two formats are supported:
+    - plain text file (VERSION) that contains only commit hash
+    - json file {"commit": <commit hexsha>, "tags": {<tag name> : <commit hexsha>} or [<tag of current commit>, ...]}
+    """
+    name = 'file'
+
+    def __init__(self, path):
+        self.path = path
+        self._data = None
+
+    @classmethod
+    def is_available(cls, path):
+        return bool(path) and os.path.isfile(path)
+
+    @property
+    def data(self):
+        if self._data is None:
+            try:
+                with open(self.path) as fh:
+                    content = fh.read()
+            except OSError as err:
+                raise ProviderError(f'Can not read build info file `{self.path}`: {err}')
+
+            try:
+                data = json.loads(content)
+            except ValueError:
+                data = {'commit': content}
+
+            if not isinstance(data, dict):
+                data = {'commit': str(data)}
+
+            data['commit'] = self.validate_commit(data.get('commit'), f'build info file `{self.path}`')
+            self._data = data
+
+        return self._data
+
+    def get_current_commit(self):
+        return self.data['commit']
+
+    @property
+    def has_repository_tags(self):
+        # list of tags contains only tags of current commit
+        return isinstance(self.data.get('tags'), dict)
+
+    @property
+    def tags(self):
+        tags = self.data.get('tags') or {}
+        if isinstance(tags, list):
+            return {tag: self.data['commit'] for tag in tags}
+        return tags
+
+
+class ArgumentCommitProvider(BaseCommitProvider):
+    name = 'arg'
+
+    def __init__(self, commit):
+        self.commit = commit
+
+    def get_current_commit(self):
+        return self.validate_commit(self.commit, '--current-commit argument')
+
+
+PROVIDERS = ('auto', GitCommitProvider.name, EnvironmentCommitProvider.name, BuildInfoCommitProvider.name,
+             ArgumentCommitProvider.name)
+
+
+def get_commit_provider(name, repo_path, build_info_path=None, current_commit=None):
+    """
+    `auto` selects the first available provider in order: argument, environment variable, build info file, git
+    """
+    if name == 'auto':
+        if current_commit:
+            name = ArgumentCommitProvider.name
+        elif EnvironmentCommitProvider.is_available():
+            name = EnvironmentCommitProvider.name
+        elif BuildInfoCommitProvider.is_available(build_info_path):
+            name = BuildInfoCommitProvider.name
+        else:
+            name = GitCommitProvider.name
+
+    if name == GitCommitProvider.name:
+        return GitCommitProvider(repo_path)
+
+    if name == EnvironmentCommitProvider.name:
+        return EnvironmentCommitProvider()
+
+    if name == BuildInfoCommitProvider.name:
+        return BuildInfoCommitProvider(build_info_path)
+
+    if name == ArgumentCommitProvider.name:
+        return ArgumentCommitProvider(current_commit)
+
+    raise ProviderError(f'Unknown commit provider `{name}`.')
@@ -0,0 +1,112 @@
+"""
+Shared access to git repository.
+One GitRepository instance should be used per command, so `git.Repo` is constructed only once.
+Tags map is read by one `git for-each-ref` call and cached on disk inside git dir,
+cache is invalidated when refs/tags or packed-refs are changed (by mtime).
+"""
+import json
+import os
+
+import git
+
+from django_rollback.consts import TAGS_CACHE_FILE_NAME
+
+TAGS_REF_PREFIX = 'refs/tags/'
+# objectname, peeled objectname (commit of annotated tag, empty for lightweight tag) and refname separated by tab
+TAGS_REF_FORMAT = '--format=%(objectname)%09%(*objectname)%09%(refname)'
+
+
+class GitRepository:
+
+    def __init__(self, path):
+        self.path = path
+        self._repo = None
+        self._tags = None
+        self._commits_tags = None
+
+    @property
+    def repo(self):
+        if self._repo is None:
+            self._repo = git.Repo(self.path)
+        return self._repo
+
+    @property
+    def common_dir(self):
+        # refs are shared between worktrees, so they are located in common dir
+        return getattr(self.repo, 'common_dir', None) or self.repo.git_dir
+
+    def get_head_commit(self):
+        return self.repo.head.commit.hexsha
+
+    @property
+    def tags(self):
+        """
+        return map {<tag name> : <commit hexsha>}
+        """
+        if self._tags is None:
+            self._tags = self._get_cached_tags()
+        return self._tags
+
+    @property
+    def commits_tags(self):
+        """
+        return map {<commit hexsha> : [<tag name>, ...]}
+        """
+        if self._commits_tags is None:
+            result = {}
+            for tag, commit in self.tags.items():
+                result.setdefault(commit, [])
+                result[commit].append(tag)
+            self._commits_tags = result
+        return self._commits_tags
+
+    def get_tag_commit(self, tag):
+        return self.tags.get(tag)
+
+    def _get_refs_key(self):
+        """
+        key for tags cache invalidation: mtime of packed-refs and the latest mtime of refs/tags directories
+        """
+        packed_refs_path = os.path.join(self.common_dir, 'packed-refs')
+        packed_refs_mtime = os.stat(packed_refs_path).st_mtime_ns if os.path.exists(packed_refs_path) else None
+
+        refs_mtime = None
+        for dir_path, _, _ in os.walk(os.path.join(self.common_dir, 'refs', 'tags')):
+            mtime = os.stat(dir_path).st_mtime_ns
+            if refs_mtime is None or mtime > refs_mtime:
+                refs_mtime = mtime
+
+        return [packed_refs_mtime, refs_mtime]
+
+    def _get_cached_tags(self):
+        cache_path = os.path.join(self.common_dir, TAGS_CACHE_FILE_NAME)
+        key = self._get_refs_key()
+
+        try:
+            with open(cache_path) as fh:
+                cache = json.load(fh)
+            if cache.get('key') == key:
+                return cache['tags']
+        except (OSError, ValueError, KeyError):
+            pass
+
+        tags = self._read_tags()
+
+        try:
+            tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w') as fh:
+                json.dump({'key': key, 'tags': tags}, fh)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            # cache is optional, for example git dir may be read only
+            pass
+
+        return tags
+
+    def _read_tags(self):
+        result = {}
+        output = self.repo.git.for_each_ref(TAGS_REF_FORMAT, TAGS_REF_PREFIX.rstrip('/'))
+        for line in output.splitlines():
+            object_sha, peeled_sha, ref_name = line.split('\t', 2)
+            result[ref_name[len(TAGS_REF_PREFIX):]] = peeled_sha or object_sha
+        return result
@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+# sent every time when timing span is finished, kwargs: span (django_rollback.profiling.Span)
+# it can be used to forward timings to metrics pipeline
+span_finished = Signal()
@@ -0,0 +1,21 @@
+"""
+Helpers for content-addressed migrations snapshots.
+Hash is calculated directly from state rows, so it can be compared with stored snapshots without serialization.
+"""
+import hashlib
+import json
+
+
+def get_state_hash(state_data):
+    """
+    state_data has type list of tuples (or lists, if loaded from json) in format:
+    [(<id> : int, <app> : str, <name> : str), ...]
+    """
+    state_hash = hashlib.sha256()
+    for migration_id, app, name in sorted(state_data, key=lambda r: r[1]):
+        state_hash.update(f'{int(migration_id)}\t{app}\t{name}\n'.encode())
+    return state_hash.hexdigest()
+
+
+def serialize_state(state_data):
+    return json.dumps(state_data)
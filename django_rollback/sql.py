@@ -1,30 +1,124 @@
 """
 Raw sql to extract migrations state for all apps in django projects (retrieve only last migration for every app)
 from django core table 'django_migrations'.
+Query is selected by database vendor, see get_migrations_state_sql().
 """
 
-MIGRATIONS_STATE_SQL = """
-with migrations AS (select
-                      dm.id,
-                      dm.app,
-                      dm.name
-                    from django_migrations dm
-), max_migrations as (
-    select
-      ms.app,
-      max(ms.id) as id
-    from migrations ms
-    group by ms.app
-)
+# PostgreSQL: one pass over sorted rows without grouping and join
+MIGRATIONS_STATE_SQL_POSTGRESQL = """
+select distinct on (dm.app)
+  dm.id,
+  dm.app,
+  dm.name
+from django_migrations dm
+order by dm.app, dm.id desc;
+"""
+
+# Oracle: window function is computed in one pass over table (Oracle does not allow `;` at the end)
+MIGRATIONS_STATE_SQL_WINDOW = """
 select
   ms.id,
   ms.app,
   ms.name
-from migrations ms
-where exists(
-    select 1
-    from max_migrations mms
-    where mms.app = ms.app and mms.id = ms.id
+from (select
+        dm.id,
+        dm.app,
+        dm.name,
+        row_number() over (partition by dm.app order by dm.id desc) as rn
+      from django_migrations dm
+) ms
+where ms.rn = 1
+order by ms.app
+"""
+
+# portable variant for other databases (SQLite, MySQL), django_migrations has no index on app column,
+# so aggregation by app and join by primary key is faster on SQLite than window function
+MIGRATIONS_STATE_SQL = """
+select
+  dm.id,
+  dm.app,
+  dm.name
+from django_migrations dm
+join (select
+        max(mm.id) as id
+      from django_migrations mm
+      group by mm.app
+) max_migrations on max_migrations.id = dm.id
+order by dm.app;
+"""
+
+
+def get_migrations_state_sql(connection):
+    """
+    return raw sql for connection vendor or None if ORM query should be used
+    """
+    if connection.vendor == 'postgresql':
+        return MIGRATIONS_STATE_SQL_POSTGRESQL
+
+    if connection.vendor == 'oracle':
+        return MIGRATIONS_STATE_SQL_WINDOW
+
+    if connection.vendor in ('sqlite', 'mysql'):
+        return MIGRATIONS_STATE_SQL
+
+    return None
+
+
+# Upsert of apps state for PostgreSQL in one statement (one round trip).
+# Snapshot and state are inserted only if state for namespace, database and commit does not exist, conflicts (unique
+# hash, namespace, database and commit) are ignored, so parallel calls can not create duplicates.
+# Snapshot is inserted only if snapshot with the same hash does not exist and migrations JSON is passed (not NULL),
+# so usually JSON is not serialized and sent, and sequence value is not spent.
+# Returns: created flag, timestamp of state for commit (NULL if concurrent transaction inserted it
+# and it is not visible yet, or snapshot does not exist and migrations JSON is not passed, so statement should be
+# repeated), commit, timestamp and snapshot hash of the latest state of the same namespace and database
+# before this statement, and flag if snapshot exists.
+SAVE_STATE_SQL_POSTGRESQL = """
+with latest as (
+    select
+      st."commit",
+      st."timestamp",
+      sn.hash
+    from {state_table} st
+    join {snapshot_table} sn on sn.id = st.snapshot_id
+    where st.namespace = %(namespace)s and st."database" = %(database)s
+    order by st."timestamp" desc, st.id desc
+    limit 1
+), existing as (
+    select
+      st.id,
+      st."timestamp"
+    from {state_table} st
+    where st.namespace = %(namespace)s and st."database" = %(database)s and st."commit" = %(commit)s
+), snapshot_inserted as (
+    insert into {snapshot_table} (hash, migrations)
+    select %(hash)s, %(migrations)s::text
+    where %(migrations)s::text is not null
+      and not exists(select 1 from existing)
+      and not exists(select 1 from latest where latest.hash = %(hash)s)
+      and not exists(select 1 from {snapshot_table} sn where sn.hash = %(hash)s)
+    on conflict (hash) do nothing
+    returning id
+), snapshot as (
+    select id from snapshot_inserted
+    union all
+    select sn.id from {snapshot_table} sn where sn.hash = %(hash)s
+    limit 1
+), state_inserted as (
+    insert into {state_table} (namespace, "database", "commit", snapshot_id, "timestamp")
+    select %(namespace)s, %(database)s, %(commit)s, snapshot.id, %(timestamp)s
+    from snapshot
+    where not exists(select 1 from existing)
+    on conflict (namespace, "database", "commit") do nothing
+    returning id, "timestamp"
 )
-order by ms.app;
+select
+  exists(select 1 from state_inserted),
+  coalesce((select "timestamp" from state_inserted), (select "timestamp" from existing)),
+  latest."commit",
+  latest."timestamp",
+  latest.hash,
+  exists(select 1 from snapshot)
+from (select 1) as one
+left join latest on true;
 """
@@ -12,16 +12,16 @@ setuptools.setup(
     long_description=long_description,
     long_description_content_type='text/markdown',
     url='https://github.com/freenoth/django-rollback',
-    packages=setuptools.find_packages(),
+    packages=setuptools.find_packages(exclude=['tests', 'tests.*']),
     classifiers=(
         'Programming Language :: Python :: 3',
         'License :: WTFPL License',
         'Operating System :: OS Independent',
-        'Framework :: Django :: 1.11',
+        'Framework :: Django',
         'Database :: PostgreSQL',
     ),
     install_requires=[
         'GitPython>=2.1.8',
-        'django>=1.11.3'
+        'django>=3.1'
     ],
 )
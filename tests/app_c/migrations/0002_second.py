@@ -0,0 +1,18 @@
+from django.db import migrations
+
+# tests of failed rollback runs set it to make reverse of this migration fail
+FAIL_REVERSE = False
+
+
+def reverse(apps, schema_editor):
+    if FAIL_REVERSE:
+        raise ValueError('reverse of app_c.0002_second failed')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [('app_c', '0001_initial')]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, reverse),
+    ]
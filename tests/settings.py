@@ -0,0 +1,29 @@
+import os
+
+SECRET_KEY = 'tests'
+USE_TZ = True
+
+INSTALLED_APPS = [
+    'django_rollback',
+    # apps with empty migrations for migration graph: app_b depends on app_a, app_c is independent
+    # (reverse of app_c.0002_second can be made to fail)
+    'tests.app_a',
+    'tests.app_b',
+    'tests.app_c',
+]
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    },
+}
+
+if os.environ.get('DJANGO_ROLLBACK_TEST_POSTGRES'):
+    # tests are run on PostgreSQL (connection options are read from PG* environment variables by libpq)
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ['DJANGO_ROLLBACK_TEST_POSTGRES'],
+    }
+
+DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
@@ -0,0 +1,101 @@
+import json
+from importlib import import_module
+from unittest import mock
+
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.migrations.recorder import MigrationRecorder
+from django.test import TestCase, TransactionTestCase
+
+from django_rollback import api
+from django_rollback.exceptions import RollbackError
+from django_rollback.log import LogSink
+from django_rollback.models import AppsState, MigrationsSnapshot, RollbackRun
+
+
+class DiffTestCase(TestCase):
+
+    def setUp(self):
+        for commit, migrations in [('a' * 40, [[1, 'app_a', '0001_initial']]),
+                                   ('b' * 40, [[2, 'app_a', '0002_second']])]:
+            snapshot = MigrationsSnapshot.objects.create(hash=commit + 'x' * 24, migrations=json.dumps(migrations))
+            AppsState.objects.create(commit=commit, snapshot=snapshot)
+
+    def test_diff(self):
+        result = api.diff('bbbb', 'aaaa')
+        self.assertEqual((result.database, result.commit_a, result.commit_b), ('default', 'b' * 40, 'a' * 40))
+        self.assertTrue(result.diff)
+
+    def test_diff_with_databases_option(self):
+        result = api.diff('bbbb', 'aaaa', databases=['default'])
+        self.assertEqual(result.commit_a, 'b' * 40)
+
+
+class ResumeRollbackTestCase(TransactionTestCase):
+    """
+    rollback from commit B to commit A unapplies app_a.0002_second, then app_c.0002_second, which reverse fails
+    """
+    commit_a = 'a' * 40
+    commit_b = 'b' * 40
+
+    def setUp(self):
+        for commit, migrations in [
+            (self.commit_a, [[1, 'app_a', '0001_initial'], [2, 'app_b', '0001_initial'], [3, 'app_c', '0001_initial']]),
+            (self.commit_b, [[6, 'app_a', '0002_second'], [2, 'app_b', '0001_initial'], [5, 'app_c', '0002_second']]),
+        ]:
+            snapshot = MigrationsSnapshot.objects.create(hash=commit + 'x' * 24, migrations=json.dumps(migrations))
+            AppsState.objects.create(commit=commit, snapshot=snapshot)
+
+        # events of expected failures are not printed
+        self.service = api.RollbackService(provider='arg', current_commit=self.commit_b, log_sink=LogSink())
+        self.fail_reverse = mock.patch.object(import_module('tests.app_c.migrations.0002_second'), 'FAIL_REVERSE',
+                                              True)
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def get_applied(self):
+        return sorted(key for key in MigrationRecorder(connection).applied_migrations() if key[0] in ('app_a', 'app_c'))
+
+    def run_failed_rollback(self):
+        with self.fail_reverse, self.assertRaises(RollbackError):
+            self.service.rollback(commit=self.commit_a)
+
+    def test_failed_run(self):
+        self.run_failed_rollback()
+
+        self.assertEqual(self.get_applied(), [('app_a', '0001_initial'), ('app_c', '0001_initial'),
+                                              ('app_c', '0002_second')])
+        run_info, = self.service.get_unfinished_runs()
+        self.assertEqual((run_info.status, run_info.unapplied, run_info.planned), (RollbackRun.STATUS_FAILED, 1, 2))
+        self.assertIn('reverse of app_c.0002_second failed', run_info.error)
+        # target state is not the last one, so failed run can be resumed
+        self.assertEqual(self.service.get_last_apps_state().commit, self.commit_b)
+
+    def test_resume(self):
+        self.run_failed_rollback()
+        run = RollbackRun.objects.get()
+
+        plan, = self.service.plan_rollback(resume=True)
+        self.assertEqual(plan.run.id, run.id)
+        self.service.rollback(plans=[plan])
+
+        self.assertEqual(self.get_applied(), [('app_a', '0001_initial'), ('app_c', '0001_initial')])
+        run.refresh_from_db()
+        self.assertEqual(run.status, RollbackRun.STATUS_FINISHED)
+        # only the remaining migration is unapplied by resumed run
+        self.assertEqual(list(run.steps.order_by('id').values_list('app', 'migration')),
+                         [('app_a', '0002_second'), ('app_c', '0002_second')])
+        self.assertEqual(self.service.get_unfinished_runs(), [])
+        self.assertEqual(self.service.get_last_apps_state().commit, self.commit_a)
+
+    def test_new_run_cancels_failed_run(self):
+        self.run_failed_rollback()
+
+        self.service.rollback(commit=self.commit_a)
+
+        self.assertEqual(list(RollbackRun.objects.order_by('id').values_list('status', flat=True)),
+                         [RollbackRun.STATUS_CANCELLED, RollbackRun.STATUS_FINISHED])
+        with self.assertRaises(RollbackError):
+            self.service.plan_rollback(resume=True)
@@ -0,0 +1,47 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from django_rollback.api import RollbackService
+from django_rollback.management.commands.check_migrations_state import Command as CheckMigrationsStateCommand
+from django_rollback.models import AppsState
+
+
+class CheckMigrationsStateTestCase(TestCase):
+    commit = 'a' * 40
+
+    def setUp(self):
+        self.options = {'provider': 'arg', 'current_commit': self.commit, 'stdout': StringIO(), 'stderr': StringIO()}
+
+    def save_state(self, state_data=None):
+        service = RollbackService(provider='arg', current_commit=self.commit)
+        if state_data is None:
+            state_data = service.get_current_migrations_state()
+        service.save_apps_state(self.commit, state_data)
+
+    def test_ok(self):
+        self.save_state()
+        call_command('check_migrations_state', **self.options)
+
+    def test_drift(self):
+        self.save_state([(1, 'app_a', '0001_initial')])
+
+        with self.assertRaises(CommandError) as context:
+            call_command('check_migrations_state', **self.options)
+        self.assertEqual(context.exception.returncode, 2)
+        self.assertEqual(AppsState.objects.count(), 1)
+
+    def test_missing(self):
+        with self.assertRaises(CommandError) as context:
+            call_command('check_migrations_state', **self.options)
+        self.assertEqual(context.exception.returncode, 3)
+
+    def test_exit_code_from_command_line(self):
+        command = CheckMigrationsStateCommand(stdout=StringIO(), stderr=StringIO())
+
+        with self.assertRaises(SystemExit) as context:
+            command.run_from_argv(['manage.py', 'check_migrations_state', '--provider', 'arg',
+                                   '--current-commit', self.commit])
+        self.assertEqual(context.exception.code, 3)
@@ -0,0 +1,89 @@
+import json
+import random
+
+from django.test import SimpleTestCase
+
+from django_rollback.diff import MigrationChange, MigrationRecord, MigrationsDiff, diff_states
+
+
+def get_baseline_migrations_diff(current, other):
+    """
+    the first version of get_migrations_diff() (by sets of records), it is a reference for rollback_records
+    """
+    result = []
+
+    current = [MigrationRecord(*rec) for rec in current]
+    other = [MigrationRecord(*rec) for rec in other]
+    other_apps = {migration.app for migration in other}
+
+    diff = set(current) - set(other)
+    for migration in diff:
+        is_new_app = migration.app not in other_apps
+        result.append(MigrationRecord(
+            migration.id,
+            migration.app,
+            'zero' if is_new_app else list(filter(lambda x: x.app == migration.app, other))[0].name,
+        ))
+    return result
+
+
+class DiffStatesTestCase(SimpleTestCase):
+    current = [
+        (10, 'added', '0001_initial'),
+        (7, 'forward', '0003_third'),
+        (2, 'backward', '0001_initial'),
+        (3, 'same', '0002_second'),
+    ]
+    other = [
+        (4, 'forward', '0002_second'),
+        (5, 'backward', '0002_second'),
+        (3, 'same', '0002_second'),
+        (6, 'removed', '0001_initial'),
+    ]
+
+    def test_classification(self):
+        self.assertEqual(diff_states(self.current, self.other), MigrationsDiff(
+            added=[MigrationRecord(10, 'added', '0001_initial')],
+            removed=[MigrationRecord(6, 'removed', '0001_initial')],
+            moved_forward=[MigrationChange(MigrationRecord(7, 'forward', '0003_third'),
+                                           MigrationRecord(4, 'forward', '0002_second'))],
+            moved_backward=[MigrationChange(MigrationRecord(2, 'backward', '0001_initial'),
+                                            MigrationRecord(5, 'backward', '0002_second'))],
+        ))
+
+    def test_equal_states(self):
+        diff = diff_states(self.current, self.current)
+
+        self.assertFalse(diff)
+        self.assertEqual(diff.rollback_records, [])
+
+    def test_rows_from_json(self):
+        """
+        states loaded from snapshot have list rows, current state from cursor has tuple rows
+        """
+        other = json.loads(json.dumps(self.other))
+
+        self.assertEqual(diff_states(self.current, other), diff_states(self.current, self.other))
+        self.assertEqual(diff_states(json.loads(json.dumps(self.current)), other),
+                         diff_states(self.current, self.other))
+
+    def test_rollback_records(self):
+        self.assertEqual(diff_states(self.current, self.other).rollback_records, [
+            MigrationRecord(10, 'added', 'zero'),
+            MigrationRecord(7, 'forward', '0002_second'),
+            MigrationRecord(2, 'backward', '0002_second'),
+        ])
+
+    def test_rollback_records_match_baseline(self):
+        rnd = random.Random(0)
+        for _ in range(50):
+            apps = [f'app_{index}' for index in range(20)]
+            current = [(rnd.randint(1, 100), app, f'{rnd.randint(1, 3):04d}') for app in rnd.sample(apps, 15)]
+            other = [(rnd.randint(1, 100), app, f'{rnd.randint(1, 3):04d}') for app in rnd.sample(apps, 15)]
+            # some apps are not changed
+            other += [record for record in current[:5] if record[1] not in {r[1] for r in other}]
+
+            with self.subTest(current=current, other=other):
+                expected = sorted(get_baseline_migrations_diff(current, other))
+                self.assertEqual(sorted(diff_states(current, json.loads(json.dumps(other))).rollback_records),
+                                 expected)
@@ -0,0 +1,154 @@
+import time
+from io import StringIO
+from unittest import mock
+
+from django.core.management.base import OutputWrapper
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.migrations.recorder import MigrationRecorder
+from django.test import TestCase, TransactionTestCase
+
+from django_rollback.api import RollbackService
+from django_rollback.diff import MigrationRecord
+from django_rollback.exceptions import RollbackError
+from django_rollback.executor import RollbackExecutor, migration_key
+from django_rollback.log import LogSink
+
+
+class SplitPlanTestCase(TestCase):
+
+    def setUp(self):
+        self.executor = RollbackExecutor(connection)
+
+    def get_plan(self, *keys):
+        return [(self.executor.loader.graph.nodes[key], True) for key in keys]
+
+    def get_keys(self, components):
+        return [[migration_key(migration) for migration, _ in component] for component in components]
+
+    def test_dependency_between_apps(self):
+        plan = self.get_plan(('app_b', '0001_initial'), ('app_c', '0002_second'), ('app_a', '0002_second'),
+                             ('app_a', '0001_initial'), ('app_c', '0001_initial'))
+
+        self.assertEqual(self.get_keys(self.executor.split_plan(plan)), [
+            [('app_b', '0001_initial'), ('app_a', '0002_second'), ('app_a', '0001_initial')],
+            [('app_c', '0002_second'), ('app_c', '0001_initial')],
+        ])
+
+    def test_independent_apps(self):
+        plan = self.get_plan(('app_c', '0002_second'), ('app_a', '0002_second'), ('app_c', '0001_initial'))
+
+        self.assertEqual(self.get_keys(self.executor.split_plan(plan)), [
+            [('app_c', '0002_second'), ('app_c', '0001_initial')],
+            [('app_a', '0002_second')],
+        ])
+
+
+class MigrateParallelTestCase(TestCase):
+
+    def test_errors_are_sorted_by_component(self):
+        executor = RollbackExecutor(connection)
+        loader = executor.loader
+
+        class FailingExecutor:
+            """
+            the first component fails after the second one
+            """
+            def __init__(self, connection, progress_callback=None):
+                self.loader = loader
+
+            def migrate(self, targets, plan):
+                app = plan[0][0].app_label
+                if app == 'app_a':
+                    time.sleep(0.2)
+                raise ValueError(app)
+
+        plan = [(loader.graph.nodes[key], True) for key in [
+            ('app_a', '0002_second'), ('app_c', '0002_second'), ('app_a', '0001_initial'), ('app_c', '0001_initial'),
+        ]]
+        with mock.patch('django_rollback.executor.MigrationExecutor', FailingExecutor):
+            with self.assertRaises(RollbackError) as context:
+                executor.migrate_parallel(plan, jobs=2)
+
+        lines = str(context.exception).splitlines()
+        self.assertEqual(lines[1:], [
+            "  group of app_a.0002_second: ValueError('app_a')",
+            "  group of app_c.0002_second: ValueError('app_c')",
+        ])
+
+    def test_directions_are_kept(self):
+        executor = RollbackExecutor(connection)
+        loader = executor.loader
+        plans = []
+
+        class RecordingExecutor:
+            def __init__(self, connection, progress_callback=None):
+                self.loader = loader
+
+            def migrate(self, targets, plan):
+                plans.append([(str(migration), backwards) for migration, backwards in plan])
+
+        plan = [(loader.graph.nodes[('app_c', '0002_second')], True),
+                (loader.graph.nodes[('app_a', '0002_second')], False)]
+        with mock.patch('django_rollback.executor.MigrationExecutor', RecordingExecutor):
+            executor.migrate_parallel(plan, jobs=2)
+
+        self.assertCountEqual(plans, [[('app_c.0002_second', True)], [('app_a.0002_second', False)]])
+
+
+class RunRollbackTestCase(TransactionTestCase):
+    """
+    migrations are executed by schema editor, sqlite does not allow it inside of atomic block of TestCase
+    """
+
+    def setUp(self):
+        self.stdout = StringIO()
+        self.service = RollbackService(log_sink=LogSink(stdout=OutputWrapper(self.stdout)))
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def get_applied(self, *apps):
+        return sorted(key for key in MigrationRecorder(connection).applied_migrations() if key[0] in apps)
+
+    def test_rollback(self):
+        self.service.run_rollback([MigrationRecord(4, 'app_a', '0001_initial'),
+                                   MigrationRecord(6, 'app_c', '0001_initial')])
+
+        self.assertEqual(self.get_applied('app_a', 'app_b', 'app_c'), [
+            ('app_a', '0001_initial'), ('app_b', '0001_initial'), ('app_c', '0001_initial'),
+        ])
+        self.assertIn('Unapplying app_a.0002_second... OK', self.stdout.getvalue())
+
+    def test_zero_target(self):
+        self.service.run_rollback([MigrationRecord(4, 'app_a', 'zero')])
+
+        self.assertEqual(self.get_applied('app_a', 'app_b', 'app_c'), [
+            ('app_c', '0001_initial'), ('app_c', '0002_second'),
+        ])
+
+    def test_fake(self):
+        applied = self.get_applied('app_a', 'app_b', 'app_c')
+
+        self.service.run_rollback([MigrationRecord(4, 'app_a', '0001_initial')], fake=True)
+
+        self.assertEqual(self.get_applied('app_a', 'app_b', 'app_c'), applied)
+        self.assertIn('Migrations plan:\n  Unapply app_a.0002_second\n', self.stdout.getvalue())
+
+    def test_mixed_directions(self):
+        """
+        app_a was moved backward after state was saved, so its target is newer than applied migration
+        """
+        MigrationExecutor(connection).migrate([('app_a', '0001_initial')])
+        records = [MigrationRecord(4, 'app_a', '0002_second'), MigrationRecord(6, 'app_c', '0001_initial')]
+
+        self.service.run_rollback(records, fake=True)
+        self.assertIn('Migrations plan:\n  Unapply app_c.0002_second\n  Apply app_a.0002_second\n',
+                      self.stdout.getvalue())
+
+        self.service.run_rollback(records)
+        self.assertEqual(self.get_applied('app_a', 'app_c'), [
+            ('app_a', '0001_initial'), ('app_a', '0002_second'), ('app_c', '0001_initial'),
+        ])
+        self.assertIn('Applying app_a.0002_second... OK', self.stdout.getvalue())
@@ -0,0 +1,103 @@
+import json
+import os
+import tempfile
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from django_rollback.api import PruneResult, RollbackService
+from django_rollback.exceptions import RollbackError
+from django_rollback.models import AppsState, MigrationsSnapshot
+from django_rollback.snapshots import get_state_hash
+
+
+class PruneStatesTestCase(TestCase):
+    """
+    states of commits c0..c5 are saved 50, 40, 30, 20, 10 and 0 days ago, c1 is tagged
+    """
+
+    def setUp(self):
+        now = timezone.now()
+        self.commits = [f'c{index}'.ljust(40, '0') for index in range(6)]
+        for index, commit in enumerate(self.commits):
+            snapshot = MigrationsSnapshot.objects.create(hash=commit.ljust(64, '0'), migrations='[]')
+            state = AppsState.objects.create(commit=commit, snapshot=snapshot)
+            AppsState.objects.filter(id=state.id).update(timestamp=now - timedelta(days=50 - index * 10))
+
+        # states of other namespace and other database are not processed
+        snapshot = MigrationsSnapshot.objects.create(hash='f' * 64, migrations='[]')
+        AppsState.objects.create(commit=self.commits[0], snapshot=snapshot, namespace='other')
+        AppsState.objects.create(commit=self.commits[0], snapshot=snapshot, database='other')
+
+        self.build_info_path = self.write_build_info({'commit': self.commits[5], 'tags': {'v1': self.commits[1]}})
+        self.service = RollbackService(provider='file', build_info_path=self.build_info_path)
+
+    def write_build_info(self, data):
+        fd, path = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(fd, 'w') as fh:
+            json.dump(data, fh)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def get_commits(self, **filters):
+        return sorted(AppsState.objects.filter(**filters).values_list('commit', flat=True))
+
+    def assertKept(self, *indexes):
+        self.assertEqual(self.get_commits(namespace='', database='default'), [self.commits[i] for i in indexes])
+        self.assertEqual(self.get_commits(namespace='other'), [self.commits[0]])
+        self.assertEqual(self.get_commits(database='other'), [self.commits[0]])
+
+    def test_keep_last(self):
+        self.assertEqual(self.service.prune_states(keep_last=2), [PruneResult('default', 3, 3, 3)])
+        self.assertKept(1, 4, 5)
+
+    def test_keep_days(self):
+        self.assertEqual(self.service.prune_states(keep_days=25), [PruneResult('default', 2, 4, 2)])
+        self.assertKept(1, 3, 4, 5)
+
+    def test_latest_state_is_kept(self):
+        self.service.prune_states(keep_days=0)
+        self.assertKept(1, 5)
+
+    def test_dry_run(self):
+        self.assertEqual(self.service.prune_states(keep_last=2, dry_run=True), [PruneResult('default', 3, 3, 0)])
+        self.assertKept(0, 1, 2, 3, 4, 5)
+
+    def test_snapshots(self):
+        current_hash = get_state_hash(self.service.get_current_migrations_state())
+        MigrationsSnapshot.objects.create(hash=current_hash, migrations='[]')
+
+        self.service.prune_states(keep_last=1)
+
+        # snapshot of current migrations is kept even if it has no states
+        self.assertEqual(sorted(MigrationsSnapshot.objects.values_list('hash', flat=True)),
+                         sorted([self.commits[1].ljust(64, '0'), self.commits[5].ljust(64, '0'), 'f' * 64,
+                                 current_hash]))
+
+    def test_partial_tags(self):
+        path = self.write_build_info({'commit': self.commits[5], 'tags': ['v5']})
+        service = RollbackService(provider='file', build_info_path=path)
+
+        with self.assertRaises(RollbackError):
+            service.prune_states(keep_last=1)
+
+        service.prune_states(keep_last=1, allow_partial_tags=True)
+        self.assertKept(5)
+
+    def test_delete_in_batches(self):
+        ids = list(AppsState.objects.filter(commit__in=self.commits[:3], database='default', namespace='')
+                   .values_list('id', flat=True))
+
+        with self.assertNumQueries(2):
+            deleted = self.service.delete_in_batches(AppsState.objects.all(), ids, batch_size=2)
+
+        self.assertEqual(deleted, 3)
+        self.assertKept(3, 4, 5)
+
+    def test_make_the_last_state_for_commit(self):
+        self.service.make_the_last_state_for_commit(self.commits[2])
+
+        self.assertKept(0, 1, 2)
+        # snapshots of deleted states are kept for reuse
+        self.assertEqual(MigrationsSnapshot.objects.count(), 7)
@@ -0,0 +1,66 @@
+from types import SimpleNamespace
+
+from django.db import connection
+from django.db.migrations.recorder import MigrationRecorder
+from django.test import SimpleTestCase, TestCase
+
+from django_rollback.api import RollbackService
+from django_rollback.sql import (
+    MIGRATIONS_STATE_SQL, MIGRATIONS_STATE_SQL_POSTGRESQL, MIGRATIONS_STATE_SQL_WINDOW, get_migrations_state_sql,
+)
+
+
+class MigrationsStateQueryTestCase(TestCase):
+
+    def setUp(self):
+        Migration = MigrationRecorder.Migration
+        Migration.objects.all().delete()
+
+        # ids of apps are interleaved, and the last migration of beta is not the last by name
+        names = [
+            ('alpha', '0001_initial'),
+            ('beta', '0001_initial'),
+            ('alpha', '0002_second'),
+            ('gamma', '0001_initial'),
+            ('beta', '0003_third'),
+            ('alpha', '0003_third'),
+            ('beta', '0002_second'),
+        ]
+        self.migrations = [Migration.objects.create(app=app, name=name) for app, name in names]
+        self.expected = [
+            (self.migrations[5].id, 'alpha', '0003_third'),
+            (self.migrations[6].id, 'beta', '0002_second'),
+            (self.migrations[3].id, 'gamma', '0001_initial'),
+        ]
+
+    def execute(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(sql)
+            return [tuple(row) for row in cursor.fetchall()]
+
+    def test_aggregate_sql(self):
+        self.assertEqual(self.execute(MIGRATIONS_STATE_SQL), self.expected)
+
+    def test_window_sql(self):
+        self.assertEqual(self.execute(MIGRATIONS_STATE_SQL_WINDOW), self.expected)
+
+    def test_orm(self):
+        self.assertEqual(RollbackService.get_current_migrations_state_orm(), self.expected)
+
+    def test_current_migrations_state(self):
+        self.assertEqual([tuple(row) for row in RollbackService().get_current_migrations_state()], self.expected)
+
+
+class MigrationsStateSqlSelectionTestCase(SimpleTestCase):
+
+    def test_vendors(self):
+        cases = [
+            ('postgresql', MIGRATIONS_STATE_SQL_POSTGRESQL),
+            ('oracle', MIGRATIONS_STATE_SQL_WINDOW),
+            ('sqlite', MIGRATIONS_STATE_SQL),
+            ('mysql', MIGRATIONS_STATE_SQL),
+            ('microsoft', None),
+        ]
+        for vendor, sql in cases:
+            with self.subTest(vendor=vendor):
+                self.assertIs(get_migrations_state_sql(SimpleNamespace(vendor=vendor)), sql)
@@ -0,0 +1,124 @@
+import json
+from unittest import mock, skipUnless
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from django_rollback.api import RollbackService
+from django_rollback.exceptions import RollbackError
+from django_rollback.models import AppsState, MigrationsSnapshot
+from django_rollback.snapshots import get_state_hash, serialize_state
+
+
+class GetAppsStateByCommitTestCase(TestCase):
+
+    def setUp(self):
+        snapshot = MigrationsSnapshot.objects.create(hash='0' * 64, migrations='[]')
+        for commit in ['abc0' + '0' * 36, 'abc1' + '0' * 36, 'abf0' + '0' * 36, 'ab' + 'f' * 38]:
+            AppsState.objects.create(commit=commit, snapshot=snapshot)
+        AppsState.objects.create(commit='abc0' + '0' * 36, snapshot=snapshot, namespace='other')
+        self.service = RollbackService()
+
+    def test_full_commit(self):
+        self.assertEqual(self.service.get_apps_state_by_commit('ABC1' + '0' * 36).commit, 'abc1' + '0' * 36)
+
+    def test_prefix(self):
+        self.assertEqual(self.service.get_apps_state_by_commit('abc0').commit, 'abc0' + '0' * 36)
+        self.assertEqual(self.service.get_apps_state_by_commit('abff').commit, 'ab' + 'f' * 38)
+
+    def test_ambiguous_prefix(self):
+        with self.assertRaises(RollbackError):
+            self.service.get_apps_state_by_commit('abc')
+
+    def test_not_found(self):
+        with self.assertRaises(RollbackError):
+            self.service.get_apps_state_by_commit('abd')
+
+
+class SaveAppsStateTestCase(TestCase):
+    """
+    save path is selected by vendor of database, so tests of ORM path are skipped on PostgreSQL and vice versa
+    """
+    state = [(1, 'app_a', '0001_initial')]
+    other_state = [(2, 'app_a', '0002_second')]
+
+    def setUp(self):
+        self.service = RollbackService()
+
+    def save(self, commit, state_data):
+        return self.service.save_apps_state(commit, state_data)
+
+    @skipUnless(connection.vendor != 'postgresql', 'ORM save path')
+    def test_created(self):
+        result = self.save('a' * 40, self.state)
+
+        self.assertEqual((result.created, result.latest_commit, result.previous_commit), (True, 'a' * 40, None))
+        self.assertEqual(AppsState.objects.get().snapshot.hash, get_state_hash(self.state))
+
+        result = self.save('b' * 40, self.other_state)
+
+        self.assertEqual((result.created, result.is_same_snapshot, result.previous_commit), (True, False, 'a' * 40))
+        state = AppsState.objects.get(commit='b' * 40)
+        self.assertEqual(state.previous_commit, 'a' * 40)
+        self.assertEqual(json.loads(state.rollback_diff), [[2, 'app_a', '0001_initial']])
+
+    @skipUnless(connection.vendor != 'postgresql', 'ORM save path')
+    def test_already_latest(self):
+        saved = self.save('a' * 40, self.state)
+
+        with self.assertNumQueries(1):
+            result = self.save('a' * 40, self.state)
+
+        self.assertEqual((result.created, result.timestamp, result.latest_commit), (False, saved.timestamp, 'a' * 40))
+        self.assertEqual(AppsState.objects.count(), 1)
+
+    @skipUnless(connection.vendor != 'postgresql', 'ORM save path')
+    def test_exists_but_not_latest(self):
+        saved = self.save('a' * 40, self.state)
+        latest = self.save('b' * 40, self.other_state)
+
+        result = self.save('a' * 40, self.state)
+
+        self.assertEqual((result.created, result.timestamp), (False, saved.timestamp))
+        self.assertEqual((result.latest_commit, result.latest_timestamp), ('b' * 40, latest.timestamp))
+        self.assertEqual(AppsState.objects.count(), 2)
+
+    @skipUnless(connection.vendor != 'postgresql', 'ORM save path')
+    def test_same_snapshot(self):
+        self.save('a' * 40, self.state)
+
+        with mock.patch('django_rollback.api.serialize_state', wraps=serialize_state) as serialize:
+            result = self.save('b' * 40, self.state)
+
+        self.assertEqual((result.created, result.is_same_snapshot, result.previous_commit), (True, True, 'a' * 40))
+        self.assertEqual(MigrationsSnapshot.objects.count(), 1)
+        # only empty rollback diff is serialized, snapshot of the latest state is reused
+        serialize.assert_called_once_with([])
+
+    @skipUnless(connection.vendor == 'postgresql', 'PostgreSQL is not used, see tests/settings.py')
+    def test_postgresql_upsert(self):
+        with mock.patch('django_rollback.api.serialize_state', wraps=serialize_state) as serialize, \
+                CaptureQueriesContext(connection) as queries:
+            result = self.service._save_apps_state_postgresql('a' * 40, self.state, get_state_hash(self.state),
+                                                              'default')
+
+        # snapshot does not exist, so statement is sent again with serialized JSON
+        self.assertEqual((result.created, result.latest_commit, result.previous_commit), (True, 'a' * 40, None))
+        self.assertEqual(len(queries), 2)
+        serialize.assert_called_once_with(self.state)
+
+        for commit, expected in [('b' * 40, (True, 'b' * 40, 'a' * 40)), ('a' * 40, (False, 'b' * 40, None))]:
+            with mock.patch('django_rollback.api.serialize_state', wraps=serialize_state) as serialize, \
+                    CaptureQueriesContext(connection) as queries:
+                result = self.service._save_apps_state_postgresql(commit, self.state, get_state_hash(self.state),
+                                                                  'default')
+
+            # snapshot exists, so JSON is not serialized and not sent
+            self.assertEqual((result.created, result.latest_commit, result.previous_commit), expected)
+            self.assertTrue(result.is_same_snapshot)
+            self.assertEqual(len(queries), 1)
+            serialize.assert_not_called()
+
+        self.assertEqual(AppsState.objects.count(), 2)
+        self.assertEqual(MigrationsSnapshot.objects.count(), 1)